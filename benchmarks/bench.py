@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# times cmake_cli commands end to end on a generated project against running
+# cmake and the build tool directly, for example:
+#   python benchmarks/bench.py --targets 20 --sources 30 --output run.json
+# only needs cmake, a C compiler and ninja or make (clang-format is optional)
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+# targets static libraries with sources files each, every source includes
+# fanout of the shared headers, plus an executable linking all libraries
+def generate(root, targets, sources, headers, fanout, seed=0):
+    rng = random.Random(seed)
+    for h in range(headers):
+        write(
+            os.path.join(root, "include", "h{}.h".format(h)),
+            "#pragma once\n\n"
+            "static inline int h{0}(int x) {{ return x * {1} + {0}; }}\n".
+            format(h, h + 1))
+
+    cmake = [
+        "cmake_minimum_required(VERSION 3.10)",
+        "project(cmake_cli_bench C)",
+        "include_directories(include)",
+    ]
+    for t in range(targets):
+        names = []
+        for s in range(sources):
+            included = rng.sample(range(headers), min(fanout, headers))
+            lines = ['#include "h{}.h"'.format(h) for h in included]
+            lines += [
+                "",
+                "int lib{}_s{}(int x) {{".format(t, s),
+            ]
+            lines += ["  x = h{}(x);".format(h) for h in included]
+            lines += ["  return x;", "}", ""]
+            name = "src/lib{}/s{}.c".format(t, s)
+            write(os.path.join(root, name), "\n".join(lines))
+            names.append(name)
+        cmake.append("add_library(lib{} STATIC {})".format(
+            t, " ".join(names)))
+
+    calls = ["int lib{}_s0(int x);".format(t) for t in range(targets)]
+    calls += ["", "int main(void) {", "  int x = 0;"]
+    calls += ["  x += lib{}_s0(x);".format(t) for t in range(targets)]
+    calls += ["  return x == 0;", "}", ""]
+    write(os.path.join(root, "src", "main.c"), "\n".join(calls))
+    cmake.append("add_executable(app src/main.c)")
+    cmake.append("target_link_libraries(app {})".format(" ".join(
+        "lib{}".format(t) for t in range(targets))))
+    write(os.path.join(root, "CMakeLists.txt"), "\n".join(cmake) + "\n")
+    # like a real project, keeps CMake's generated sources out of format
+    write(os.path.join(root, ".gitignore"), "build/\n")
+
+    return headers + targets * sources + 1
+
+
+def remove(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def run(cmd, cwd, env):
+    process = subprocess.run(cmd,
+                             cwd=cwd,
+                             env=env,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+    if process.returncode != 0:
+        print(process.stdout, file=sys.stderr)
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+# setup runs untimed before every repetition
+def timed(cmd, cwd, env, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run(cmd, cwd, env)
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "runs": times,
+    }
+
+
+def version_of(cmd):
+    try:
+        return subprocess.run(cmd,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except OSError:
+        return None
+
+
+# first line of the version, or "unavailable" if the tool isn't installed
+def tool_version(cmd):
+    out = version_of(cmd)
+    if not out:
+        return "unavailable"
+    return out.split("\n")[0]
+
+
+def environment(generator):
+    return {
+        "cmake_cli_revision":
+        version_of(["git", "-C", repo_dir, "rev-parse", "HEAD"]),
+        "python": platform.python_version(),
+        "cmake": tool_version(["cmake", "--version"]),
+        "generator": generator,
+        "build_tool": tool_version(["ninja", "--version"]
+                                   if generator == "Ninja" else
+                                   ["make", "--version"]),
+        "clang_format": tool_version(["clang-format", "--version"]),
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+
+def benchmark(root, generator, repeat):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [repo_dir] + [p for p in [env.get("PYTHONPATH")] if p])
+    # keep cmake_cli's per user state out of the real cache
+    env["XDG_CACHE_HOME"] = os.path.join(root, ".xdg_cache")
+
+    cmake_cli = [sys.executable, "-m", "cmake_cli.entry_point"]
+    gen_args = ["--generator", generator]
+    own_dir = os.path.join(root, "build", "debug")
+    raw_dir = os.path.join(root, "build", "raw")
+    raw_gen = [
+        "cmake", "-G", generator, "-B", raw_dir, "-S", root,
+        "-DCMAKE_BUILD_TYPE=Debug"
+    ]
+    if generator == "Ninja":
+        raw_build = ["ninja", "-C", raw_dir]
+    else:
+        raw_build = ["make", "-C", raw_dir, "-j", str(os.cpu_count())]
+
+    def bench(own_cmd, baseline_cmd, own_setup=None, baseline_setup=None,
+              runs=repeat):
+        print("running", own_cmd[len(cmake_cli):], file=sys.stderr)
+        return {
+            "cmake_cli": timed(own_cmd, root, env, runs, own_setup),
+            "baseline": timed(baseline_cmd, root, env, runs, baseline_setup),
+        }
+
+    results = {}
+    results["startup"] = bench(
+        cmake_cli + ["build", "--skip-gen", "--skip-build"],
+        [sys.executable, "-c", ""])
+    results["configure_cold"] = bench(
+        cmake_cli + ["build", "--skip-build"] + gen_args,
+        raw_gen,
+        own_setup=lambda: remove(own_dir),
+        baseline_setup=lambda: remove(raw_dir))
+    results["configure_warm"] = bench(
+        cmake_cli + ["build", "--skip-build"] + gen_args, raw_gen)
+    # a full build is slow, so only once
+    results["build_full"] = bench(
+        cmake_cli + ["build"] + gen_args,
+        raw_build,
+        own_setup=lambda: run(["cmake", "--build", own_dir, "--target",
+                               "clean"], root, env),
+        baseline_setup=lambda: run(["cmake", "--build", raw_dir, "--target",
+                                    "clean"], root, env),
+        runs=1)
+    results["build_noop"] = bench(cmake_cli + ["build"] + gen_args,
+                                  raw_build)
+
+    def remove_compile_commands():
+        remove(os.path.join(root, "compile_commands.json"))
+        remove(os.path.join(own_dir, "compile_commands.json"))
+
+    raw_cc = ["cmake", "-DCMAKE_EXPORT_COMPILE_COMMANDS=YES", raw_dir]
+    results["compile_commands_cold"] = bench(
+        cmake_cli + ["compile_commands"],
+        raw_cc,
+        own_setup=remove_compile_commands)
+    results["compile_commands_warm"] = bench(
+        cmake_cli + ["compile_commands"], raw_cc)
+
+    if shutil.which("clang-format") is None:
+        print("clang-format not found, skipping format", file=sys.stderr)
+    else:
+        files = []
+        for directory, _, names in os.walk(root):
+            if not directory.startswith(os.path.join(root, "build")):
+                files += [
+                    os.path.relpath(os.path.join(directory, n), root)
+                    for n in names if n.endswith((".c", ".h"))
+                ]
+        # format once so every timed run does the same work
+        run(["clang-format", "-i"] + files, root, env)
+        format_cache = os.path.join(root, "build", "cmake_cli_cache",
+                                    "format.json")
+        raw_format = ["clang-format", "-i"] + files
+        results["format_cold"] = bench(
+            cmake_cli + ["format"],
+            raw_format,
+            own_setup=lambda: remove(format_cache))
+        results["format_warm"] = bench(cmake_cli + ["format"], raw_format)
+        for name in ["format_cold", "format_warm"]:
+            results[name]["files"] = len(files)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark cmake_cli against plain cmake')
+    parser.add_argument('--targets', type=int, default=10)
+    parser.add_argument('--sources',
+                        type=int,
+                        default=20,
+                        help='sources per target')
+    parser.add_argument('--headers', type=int, default=50)
+    parser.add_argument('--fanout',
+                        type=int,
+                        default=10,
+                        help='headers included by each source')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--generator',
+                        default=None,
+                        help='defaults to Ninja if installed, else Unix '
+                        'Makefiles')
+    parser.add_argument('--work-dir',
+                        default=None,
+                        help='where to generate the project (default: a '
+                        'temporary directory which is removed)')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    generator = args.generator
+    if generator is None:
+        generator = "Unix Makefiles"
+        if shutil.which("ninja") is not None:
+            generator = "Ninja"
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="cmake_cli_bench_")
+    else:
+        remove(work_dir)
+    try:
+        files = generate(work_dir, args.targets, args.sources, args.headers,
+                         args.fanout)
+        results = benchmark(work_dir, generator, args.repeat)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    out = {
+        "parameters": {
+            "targets": args.targets,
+            "sources": args.sources,
+            "headers": args.headers,
+            "fanout": args.fanout,
+            "repeat": args.repeat,
+            "files": files,
+        },
+        "environment": environment(generator),
+        "results": results,
+    }
+    contents = json.dumps(out, indent=2, sort_keys=True)
+    if args.output is None:
+        print(contents)
+    else:
+        with open(args.output, "w") as f:
+            f.write(contents + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,52 @@
 import argparse
+import io
+import json
 import subprocess
-import multiprocessing
 import shutil
 import os
 import sys
+import time
 from contextlib import suppress
 
+from cmake_cli import resources
+from cmake_cli.cache import (atomic_write_json, hash_json, load_json,
+                             user_cache_dir)
+from cmake_cli.output_processor import OutputProcessor
+
+# modules only needed by some subcommands are imported where they are used to
+# keep startup fast for editors and hooks which call build in a loop
+
 base_has_build_testing_default = True
 base_build_testing_default = None
 
+linker_flag_prefix = "-fuse-ld="
+
+# hooks which built shell pipelines for finding files, with what replaced
+# them. Overrides of these would be silently ignored.
+removed_hooks = {
+    "find_c_family_files_command": "find_c_family_files",
+    "git_diff_find_c_family_files_cmd": "git_diff_find_c_family_files",
+    "xargs_cmd": "find_c_family_files",
+}
+
+
+def positive_int(value):
+    out = int(value)
+    if out < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return out
+
 
 class BaseCMakeBuilder():
     @staticmethod
     def base_build_dir():
         return "build"
 
+    # state kept between invocations which isn't specific to one build
+    # directory
+    def cache_dir(self):
+        return os.path.join(self.base_build_dir(), "cmake_cli_cache")
+
     @staticmethod
     def pager_list():
         return [["less", "-RFX"], ["bat", "-p"], ["more"]]
@@ -27,6 +59,65 @@ class BaseCMakeBuilder():
     def ccache_default():
         return False
 
+    # None leaves the compiler cache's own configuration (environment
+    # variables, config files) alone
+    @staticmethod
+    def compiler_cache_dir():
+        return None
+
+    # for example "20G"
+    @staticmethod
+    def compiler_cache_size():
+        return None
+
+    # tried in order when the compiler cache is "auto"
+    def compiler_cache_backends(self):
+        from cmake_cli import compiler_cache
+
+        return [
+            backend(cache_dir=self.compiler_cache_dir(),
+                    max_size=self.compiler_cache_size())
+            for backend in [compiler_cache.Ccache, compiler_cache.Sccache]
+        ]
+
+    # one of linkers(), "auto" for the first installed or None for the
+    # compiler's default
+    @staticmethod
+    def linker_default():
+        return None
+
+    # (name passed to -fuse-ld, executables which provide it) in the order
+    # "auto" tries them
+    @staticmethod
+    def linkers():
+        return [
+            ("mold", ["ld.mold", "mold"]),
+            ("lld", ["ld.lld"]),
+            ("gold", ["ld.gold"]),
+        ]
+
+    # with True --multi-config is the default
+    @staticmethod
+    def multi_config_default():
+        return False
+
+    # the configurations a multi-config build directory is generated for
+    @staticmethod
+    def multi_config_types():
+        return ["Debug", "Release", "RelWithDebInfo"]
+
+    # start new build directories from the compiler detection and probe
+    # results of a compatible configured one
+    @staticmethod
+    def seed_default():
+        return False
+
+    # True or False forces unity builds on or off, None uses the setting
+    # found by unity_tune if there is one
+    @staticmethod
+    def unity_default():
+        return None
+
     @staticmethod
     def default_cxx_compiler():
         return None
@@ -78,39 +169,73 @@ class BaseCMakeBuilder():
         return self.cmake_command()
 
     @staticmethod
-    def piped_runner(cmds, env=None):
+    def ctest_command():
+        return ["ctest"]
+
+    @staticmethod
+    def piped_runner(cmds, env=None, output=None, processor=None):
         processes = []
         cmd_process = None
-        print("running:", cmds)
+        print("running:", cmds, file=output, flush=True)
         for i, c in enumerate(cmds):
             last = i == len(cmds) - 1
             first = i == 0
-            if last:
-                stdout = None
-                stderr = None
+            if first and processor is not None:
+                stdout = subprocess.PIPE
+                stderr = subprocess.STDOUT
+            elif last:
+                stdout = output
+                stderr = None if output is None else subprocess.STDOUT
             else:
                 stdout = subprocess.PIPE
                 stderr = subprocess.STDOUT
-            cmd_process = subprocess.Popen(
-                c,
-                stdout=stdout,
-                stderr=stderr,
-                stdin=None if cmd_process is None else cmd_process.stdout,
-                env=env if first else None)
+            if i == 1 and processor is not None:
+                stdin = subprocess.PIPE
+            else:
+                stdin = None if cmd_process is None else cmd_process.stdout
+            cmd_process = subprocess.Popen(c,
+                                           stdout=stdout,
+                                           stderr=stderr,
+                                           stdin=stdin,
+                                           env=env if first else None)
             processes.append(cmd_process)
 
+        if processor is not None:
+            if len(processes) > 1:
+                processed_output = io.TextIOWrapper(processes[1].stdin,
+                                                    errors="replace")
+                is_tty = False
+            else:
+                processed_output = sys.stdout if output is None else output
+                is_tty = processed_output.isatty()
+            processor.run(processes[0].stdout, processed_output, is_tty)
+            processes[0].stdout.close()
+            if processes[0].wait() != 0:
+                with suppress(BrokenPipeError):
+                    processed_output.write(processor.summary())
+                    processed_output.flush()
+            if len(processes) > 1:
+                with suppress(BrokenPipeError):
+                    processed_output.close()
+
         for process in reversed(processes):
             process.wait()
             if process.returncode != 0:
                 sys.exit(process.returncode)
 
-    def runner(self, cmd, env=None):
-        self.piped_runner([cmd], env=env)
+    def runner(self, cmd, env=None, output=None):
+        self.piped_runner([cmd], env=env, output=output)
 
     @staticmethod
     def extend_piped_commands():
         return []
 
+    # callables taking a line of build output (without the newline) and
+    # returning the line to print or None to drop it
+    @staticmethod
+    def extend_output_filters():
+        return []
+
     @staticmethod
     def extend_gen_cmd():
         return []
@@ -119,6 +244,460 @@ class BaseCMakeBuilder():
     def extend_build_cmd():
         return []
 
+    @staticmethod
+    def gen_fingerprint_env_vars():
+        return [
+            "CC", "CXX", "CUDACXX", "CUDAHOSTCXX", "CFLAGS", "CXXFLAGS",
+            "CUDAFLAGS", "LDFLAGS", "CMAKE_PREFIX_PATH"
+        ]
+
+    @staticmethod
+    def gen_fingerprint_path(directory):
+        return os.path.join(directory, "cmake_cli_gen_fingerprint.json")
+
+    @staticmethod
+    def build_system_exists(directory):
+        if not os.path.exists(os.path.join(directory, "CMakeCache.txt")):
+            return False
+        return any(
+            os.path.exists(os.path.join(directory, f))
+            for f in ["build.ninja", "Makefile"])
+
+    def gen_fingerprint(self, gen_cmd, env=None):
+        if env is None:
+            env = os.environ
+        # the generated build system reruns cmake on its own when
+        # CMakeLists.txt changes, so only the inputs cmake can't see matter
+        contents = {
+            "gen_cmd": gen_cmd,
+            "cwd": os.getcwd(),
+            "env": {
+                var: env.get(var)
+                for var in self.gen_fingerprint_env_vars()
+            },
+        }
+        contents["fingerprint"] = hash_json(contents)
+        return contents
+
+    def read_gen_fingerprint(self, directory):
+        return load_json(self.gen_fingerprint_path(directory))
+
+    def gen_up_to_date(self, directory, fingerprint):
+        if not self.build_system_exists(directory):
+            return False
+        existing = self.read_gen_fingerprint(directory)
+        return (existing is not None and existing.get("fingerprint")
+                == fingerprint["fingerprint"])
+
+    def gen(self, directory, gen_cmd, force_gen=False, env=None,
+            output=None):
+        fingerprint = self.gen_fingerprint(gen_cmd, env=env)
+        profile = self.profile_configure()
+        if (not force_gen and not profile
+                and self.gen_up_to_date(directory, fingerprint)):
+            print("generation up to date, skipping (use --force-gen to "
+                  "regenerate)",
+                  file=output)
+            return
+
+        # a failed generation must not leave a matching fingerprint behind
+        with suppress(FileNotFoundError):
+            os.remove(self.gen_fingerprint_path(directory))
+        if self.seed_enabled() and not os.path.exists(
+                os.path.join(directory, "CMakeCache.txt")):
+            self.seed_directory(directory, fingerprint, output)
+        if profile:
+            from cmake_cli import configure_profile
+
+            # the fingerprint is of the command without the profiling flags.
+            # CMake opens the trace before creating the build directory.
+            os.makedirs(directory, exist_ok=True)
+            trace = configure_profile.trace_path(directory)
+            gen_cmd = gen_cmd + configure_profile.profile_args(trace)
+        self.runner(gen_cmd, env=env, output=output)
+        with open(self.gen_fingerprint_path(directory), "w") as f:
+            json.dump(fingerprint, f, indent=2, sort_keys=True)
+        if profile:
+            self.print_configure_profile(trace, output)
+
+    def profile_configure(self):
+        with suppress(AttributeError):
+            return self.args.profile_configure
+        return False
+
+    @staticmethod
+    def print_configure_profile(trace, output=None):
+        from cmake_cli import configure_profile
+
+        summary = None
+        with suppress(OSError, ValueError):
+            summary = configure_profile.summarize(
+                configure_profile.read_calls(trace))
+        if summary is None:
+            print("WARN: no configure profile in", trace, file=output)
+            return
+        print(configure_profile.format_summary(summary), file=output)
+        print("trace (for chrome://tracing or ui.perfetto.dev):",
+              trace,
+              file=output)
+
+    def seed_enabled(self):
+        with suppress(AttributeError):
+            if self.args.seed is not None:
+                return self.args.seed
+        return self.seed_default()
+
+    # a configured build directory whose compilers and generation arguments
+    # (apart from build type) match, None if there isn't one
+    def seed_source(self, directory, fingerprint):
+        from cmake_cli import seed
+
+        key = seed.compatibility_key(fingerprint)
+        for sibling in self.configured_directories():
+            if os.path.abspath(sibling) == os.path.abspath(directory):
+                continue
+            existing = self.read_gen_fingerprint(sibling)
+            if (existing is not None
+                    and seed.compatibility_key(existing) == key):
+                return sibling
+        return None
+
+    def seed_directory(self, directory, fingerprint, output=None):
+        from cmake_cli import seed
+
+        sibling = self.seed_source(directory, fingerprint)
+        if sibling is not None:
+            print("seeding", directory, "from", sibling, file=output)
+            seed.seed(sibling, directory)
+
+    @staticmethod
+    def append_args(cmd, args):
+        if args is not None:
+            cmd += args.split()
+
+    @staticmethod
+    def get_build_type(is_release, release_debug_info):
+        if is_release:
+            if release_debug_info:
+                return "RelWithDebInfo"
+            return "Release"
+        return "Debug"
+
+    def multi_config(self):
+        with suppress(AttributeError):
+            if self.args.multi_config is None:
+                return self.multi_config_default()
+            return self.args.multi_config
+        return False
+
+    def generator(self):
+        if self.multi_config():
+            return "Ninja Multi-Config"
+        return self.args.generator
+
+    # the build type selected by the arguments
+    def build_config(self):
+        is_release = False
+        release_debug_info = False
+        with suppress(AttributeError):
+            is_release = self.args.release
+        with suppress(AttributeError):
+            release_debug_info = self.args.release_debug_info
+        return self.get_build_type(is_release, release_debug_info)
+
+    # from how the directory was generated, not from the arguments
+    def is_multi_config(self, directory):
+        return (self.read_cmake_cache(directory).get("CMAKE_GENERATOR") ==
+                "Ninja Multi-Config")
+
+    # the manifest ninja tools need to see the targets of the selected build
+    # type in a multi-config directory, None for the default build.ninja
+    def ninja_file(self, directory):
+        if self.is_multi_config(directory):
+            return "build-{}.ninja".format(self.build_config())
+        return None
+
+    def compiler_cache(self, warn=True):
+        from cmake_cli import compiler_cache
+
+        choice = None
+        with suppress(AttributeError):
+            if self.args.ccache:
+                choice = "auto"
+        with suppress(AttributeError):
+            if self.args.compiler_cache is not None:
+                choice = self.args.compiler_cache
+        if choice is None:
+            return None
+
+        backends = self.compiler_cache_backends()
+        backend = compiler_cache.select(choice, backends)
+        if backend is None and warn:
+            names = [b.name for b in backends if choice in ("auto", b.name)]
+            print("WARN:", " or ".join(names) or choice, "not found in path")
+        return backend
+
+    def compiler_cache_env(self):
+        backend = self.compiler_cache(warn=False)
+        if backend is None:
+            return {}
+        return backend.env()
+
+    def compiler_launcher(self):
+        backend = self.compiler_cache()
+        if backend is None:
+            return []
+        return [backend.executable()]
+
+    def linker(self):
+        choice = self.linker_default()
+        with suppress(AttributeError):
+            if self.args.linker is not None:
+                choice = self.args.linker
+        if choice is None or choice == "default":
+            return None
+
+        for name, executables in self.linkers():
+            if choice in ("auto", name):
+                if any(self.exists_in_path(e) for e in executables):
+                    return name
+                if choice == name:
+                    print("WARN:", " or ".join(executables),
+                          "not found in path")
+        return None
+
+    # the linker a build directory was generated with, from its cache
+    def configured_linker(self, directory):
+        flags = self.read_cmake_cache(directory).get(
+            "CMAKE_EXE_LINKER_FLAGS", "")
+        for flag in flags.split():
+            if flag.startswith(linker_flag_prefix):
+                return flag[len(linker_flag_prefix):]
+        return "default"
+
+    # only the -fuse-ld= flag is added or replaced, other linker flags (from
+    # LDFLAGS, which CMake reads when the cache is created, or the user)
+    # stay. Like the launchers, a flag set by an earlier generation is
+    # removed when the linker goes back to the default.
+    def linker_gen_args(self, directory):
+        linker = self.linker()
+        cache = self.read_cmake_cache(directory)
+        # CMake always caches the flags, so whether the last generation
+        # passed them tells if they are managed here. They keep being passed
+        # after the linker went back to the default, otherwise the command
+        # (and its fingerprint) would change once more.
+        previous = self.read_gen_fingerprint(directory) or {}
+        gen_args = []
+        for kind in ["EXE", "SHARED", "MODULE"]:
+            var = "CMAKE_{}_LINKER_FLAGS".format(kind)
+            if var in cache:
+                flags = cache[var].split()
+            else:
+                flags = os.environ.get("LDFLAGS", "").split()
+            kept = [f for f in flags if not f.startswith(linker_flag_prefix)]
+            if linker is not None:
+                kept.append(linker_flag_prefix + linker)
+            elif kept == flags and not any(
+                    arg.startswith("-D{}=".format(var))
+                    for arg in previous.get("gen_cmd", [])):
+                continue
+            gen_args.append("-D{}={}".format(var, " ".join(kept)))
+        return gen_args
+
+    @staticmethod
+    def read_cmake_cache(directory):
+        out = {}
+        with suppress(OSError):
+            with open(os.path.join(directory, "CMakeCache.txt")) as f:
+                for line in f:
+                    if line.startswith(("#", "//")) or "=" not in line:
+                        continue
+                    name_type, _, value = line.rstrip("\n").partition("=")
+                    out[name_type.split(":")[0]] = value
+        return out
+
+    @staticmethod
+    def is_own_launcher(value):
+        return "ccache" in value or "cmake_cli.rusage_launcher" in value
+
+    # a launcher set by an earlier generation is cleared when its option is
+    # turned off, anything else in the cache is left alone. Once cleared the
+    # empty value keeps being passed, so the generation command (and its
+    # fingerprint) stays the same from then on.
+    def launcher_gen_args(self, directory):
+        compiler_launcher = self.compiler_launcher()
+        linker_launcher = []
+        with suppress(AttributeError):
+            if self.args.track_memory:
+                rusage = [
+                    sys.executable, "-m", "cmake_cli.rusage_launcher",
+                    resources.rusage_log_path(directory)
+                ]
+                compiler_launcher = rusage + ["compile"] + compiler_launcher
+                linker_launcher = rusage + ["link"]
+
+        cache = self.read_cmake_cache(directory)
+        gen_args = []
+        for lang in ["C", "CXX", "CUDA"]:
+            kinds = [("COMPILER", compiler_launcher)]
+            # CMake has no CMAKE_CUDA_LINKER_LAUNCHER
+            if lang != "CUDA":
+                kinds.append(("LINKER", linker_launcher))
+            for kind, launcher in kinds:
+                var = "CMAKE_{}_{}_LAUNCHER".format(lang, kind)
+                cached = cache.get(var)
+                if (launcher or cached == ""
+                        or self.is_own_launcher(cached or "")):
+                    gen_args.append("-D{}={}".format(var,
+                                                     ";".join(launcher)))
+        return gen_args
+
+    @staticmethod
+    def unity_tune_path():
+        return os.path.join(user_cache_dir(), "unity.json")
+
+    def project_key(self):
+        source_dir = None
+        with suppress(AttributeError):
+            source_dir = self.args.source_dir
+        return os.path.abspath(source_dir if source_dir is not None else ".")
+
+    # (unity, batch size) where batch size None is CMake's default
+    def unity_setting(self):
+        try:
+            unity = self.args.unity
+            batch_size = self.args.unity_batch_size
+        except AttributeError:
+            return False, None
+        if unity is None:
+            unity = self.unity_default()
+        if unity is None and batch_size is not None:
+            unity = True
+        if unity is None:
+            tuned = load_json(self.unity_tune_path(),
+                              {}).get(self.project_key())
+            if tuned is None:
+                return False, None
+            unity = tuned["unity"]
+            batch_size = tuned["batch_size"]
+        return unity, batch_size
+
+    # turning unity builds off only passes anything if an earlier generation
+    # turned them on
+    def unity_gen_args(self, directory):
+        unity, batch_size = self.unity_setting()
+        if not unity:
+            # once the cache has the variable OFF is always passed, so the
+            # generation command doesn't change again after turning it off
+            if "CMAKE_UNITY_BUILD" in self.read_cmake_cache(directory):
+                return ["-DCMAKE_UNITY_BUILD=OFF"]
+            return []
+        gen_args = ["-DCMAKE_UNITY_BUILD=ON"]
+        if batch_size is not None:
+            gen_args.append(
+                "-DCMAKE_UNITY_BUILD_BATCH_SIZE={}".format(batch_size))
+        return gen_args
+
+    def get_gen_cmd(self, directory, build_type, additional_gen_args=None):
+        if additional_gen_args is None:
+            additional_gen_args = []
+
+        gen_args = []
+
+        with suppress(AttributeError):
+            gen_args.append("-G" + self.generator())
+
+        gen_args.append("-B" + directory)
+        if self.multi_config():
+            # the build type is picked at build time, so switching it
+            # doesn't regenerate
+            gen_args.append("-DCMAKE_CONFIGURATION_TYPES=" +
+                            ";".join(self.multi_config_types()))
+        else:
+            gen_args.append("-DCMAKE_BUILD_TYPE=" + build_type)
+
+        if self.args.source_dir is not None:
+            gen_args += [self.args.source_dir]
+
+        gen_args += self.launcher_gen_args(directory)
+        gen_args += self.linker_gen_args(directory)
+        gen_args += self.unity_gen_args(directory)
+
+        link_pool = []
+        with suppress(AttributeError):
+            if self.args.track_memory:
+                link_jobs = resources.auto_link_jobs(directory)
+                if (self.generator().startswith("Ninja")
+                        and link_jobs is not None
+                        and link_jobs < resources.cpu_limit()):
+                    link_pool = [
+                        "-DCMAKE_JOB_POOLS=cmake_cli_link={}".format(
+                            link_jobs),
+                        "-DCMAKE_JOB_POOL_LINK=cmake_cli_link"
+                    ]
+        if link_pool:
+            gen_args += link_pool
+        elif (self.read_cmake_cache(directory).get("CMAKE_JOB_POOL_LINK") ==
+              "cmake_cli_link"):
+            # the pool of an earlier generation, which no longer applies
+            gen_args += ["-UCMAKE_JOB_POOLS", "-UCMAKE_JOB_POOL_LINK"]
+
+        with suppress(AttributeError):
+            if self.args.build_testing is not None:
+                if self.args.build_testing:
+                    gen_args += ["-DBUILD_TESTING=ON"]
+                else:
+                    gen_args += ["-DBUILD_TESTING=OFF"]
+
+        gen_cmd = (self.cmake_command() + gen_args + additional_gen_args +
+                   self.extend_gen_cmd())
+        with suppress(AttributeError):
+            self.append_args(gen_cmd, self.args.gen_args)
+
+        return gen_cmd
+
+    # config is the build type of multi-config directories, by default the
+    # one selected by the arguments
+    def get_build_cmd(self,
+                      directory,
+                      additional_build_args=None,
+                      threads=None,
+                      config=None):
+        if additional_build_args is None:
+            additional_build_args = []
+
+        build_args = ["--build", directory]
+        if self.is_multi_config(directory):
+            if config is None:
+                config = self.build_config()
+            build_args += ["--config", config]
+
+        if threads is None:
+            if getattr(self.args, "auto_jobs", False):
+                build_args += ["-j", str(resources.auto_jobs(directory))]
+            elif self.generator() == "Unix Makefiles":
+                build_args += ["-j", str(os.cpu_count())]
+        else:
+            build_args += ["-j", str(threads)]
+
+        build_cmd = (self.build_cmake_command() + build_args +
+                     additional_build_args + self.extend_build_cmd())
+        with suppress(AttributeError):
+            self.append_args(build_cmd, self.args.build_args)
+
+        native_build_tool_args = ["--"]
+
+        if self.args.keep_going:
+            if self.generator() == "Unix Makefiles":
+                native_build_tool_args += ["-k"]
+            elif self.generator().startswith("Ninja"):
+                native_build_tool_args += ["-k", "0"]
+        with suppress(AttributeError):
+            self.append_args(native_build_tool_args,
+                             self.args.native_build_tool_args)
+
+        return build_cmd + native_build_tool_args
+
     def build(self,
               directory,
               is_release=False,
@@ -127,9 +706,14 @@ class BaseCMakeBuilder():
               additional_build_args=None,
               piped_commands=None,
               skip_gen=False,
-              skip_build=False):
+              skip_build=False,
+              force_gen=False):
+        from cmake_cli import ninja_log
+
         with suppress(AttributeError):
             skip_gen = self.args.skip_gen
+        with suppress(AttributeError):
+            force_gen = self.args.force_gen
         with suppress(AttributeError):
             skip_build = self.args.skip_build
 
@@ -138,75 +722,20 @@ class BaseCMakeBuilder():
                 "WARN: no commands will be run as gen and build were skipped")
             return
 
-        if additional_gen_args is None:
-            additional_gen_args = []
-        if additional_build_args is None:
-            additional_build_args = []
         if piped_commands is None:
             piped_commands = []
 
-        def append_args(cmd, args):
-            if args is not None:
-                cmd += args.split()
+        with suppress(AttributeError):
+            is_release = self.args.release
+        with suppress(AttributeError):
+            release_debug_info = self.args.release_debug_info
+        build_type = self.get_build_type(is_release, release_debug_info)
 
         if not skip_gen:
-            with suppress(AttributeError):
-                is_release = self.args.release
-            with suppress(AttributeError):
-                release_debug_info = self.args.release_debug_info
-
-            if is_release:
-                if release_debug_info:
-                    build_type = "RelWithDebInfo"
-                else:
-                    build_type = "Release"
-            else:
-                build_type = "Debug"
-
-            gen_args = []
-
-            with suppress(AttributeError):
-                gen_args.append("-G" + self.args.generator)
-
-            gen_args += [
-                "-B" + directory,
-                "-DCMAKE_BUILD_TYPE=" + build_type,
-            ]
-
-            if self.args.source_dir is not None:
-                gen_args += [self.args.source_dir]
-
-            with suppress(AttributeError):
-                if self.args.ccache:
-                    if self.exists_in_path_warn("ccache"):
-                        gen_args += [
-                            "-DCMAKE_C_COMPILER_LAUNCHER=ccache",
-                            "-DCMAKE_CXX_COMPILER_LAUNCHER=ccache",
-                            "-DCMAKE_CUDA_COMPILER_LAUNCHER=ccache"
-                        ]
-
-            with suppress(AttributeError):
-                if self.args.build_testing is not None:
-                    if self.args.build_testing:
-                        gen_args += ["-DBUILD_TESTING=ON"]
-                    else:
-                        gen_args += ["-DBUILD_TESTING=OFF"]
-
-            gen_cmd = (self.cmake_command() + gen_args + additional_gen_args +
-                       self.extend_gen_cmd())
-            with suppress(AttributeError):
-                append_args(gen_cmd, self.args.gen_args)
-
-            self.runner(gen_cmd)
+            gen_cmd = self.get_gen_cmd(directory, build_type,
+                                       additional_gen_args)
+            self.gen(directory, gen_cmd, force_gen=force_gen)
         if not skip_build:
-            build_args = ["--build", directory]
-
-            if self.args.threads is None:
-                if self.args.generator == "Unix Makefiles":
-                    build_args += ["-j", str(multiprocessing.cpu_count())]
-            else:
-                build_args += ["-j", str(self.args.threads)]
-
             with suppress(AttributeError):
                 if self.args.page:
                     pager = self.get_pager()
@@ -215,30 +744,93 @@ class BaseCMakeBuilder():
 
             piped_commands += self.extend_piped_commands()
 
-            build_cmd = (self.build_cmake_command() + build_args +
-                         additional_build_args + self.extend_build_cmd())
-            with suppress(AttributeError):
-                append_args(build_cmd, self.args.build_args)
-
-            native_build_tool_args = ["--"]
+            build_cmd = self.get_build_cmd(directory,
+                                           additional_build_args,
+                                           threads=self.args.threads,
+                                           config=build_type)
 
-            if self.args.keep_going:
-                if self.args.generator == "Unix Makefiles":
-                    native_build_tool_args += ["-k"]
-                elif self.args.generator == "Ninja":
-                    native_build_tool_args += ["-k", "0"]
+            processor = None
+            log = None
             with suppress(AttributeError):
-                append_args(native_build_tool_args,
-                            self.args.native_build_tool_args)
+                if not self.args.raw_output:
+                    if self.args.build_log:
+                        from cmake_cli.build_log import BuildLog
+
+                        log = BuildLog(self.build_log_dir(directory),
+                                       directory,
+                                       keep=self.build_log_keep())
+                    processor = OutputProcessor(
+                        filters=self.extend_output_filters(),
+                        max_diagnostics=self.args.max_diagnostics,
+                        log=log)
 
             build_env = None
-            if self.args.force_color or (piped_commands
+            cache_backend = self.compiler_cache(warn=False)
+            if cache_backend is not None and cache_backend.env():
+                build_env = dict(os.environ, **cache_backend.env())
+            piped = bool(piped_commands) or (processor is not None
+                                             and sys.stdout.isatty())
+            if self.args.force_color or (piped
                                          and self.args.force_color_when_piped):
-                build_env = {"CLICOLOR_FORCE": "TRUE"}
+                build_env = dict(build_env or os.environ,
+                                 CLICOLOR_FORCE="TRUE")
+
+            stats_before = None
+            if cache_backend is not None:
+                stats_before = cache_backend.stats()
+            # so reports only read what this build adds to the log
+            log_position = ninja_log.log_position(directory)
+            returncode = 1
+            try:
+                self.piped_runner([build_cmd] + piped_commands,
+                                  env=build_env,
+                                  processor=processor)
+                returncode = 0
+            except SystemExit as e:
+                returncode = e.code
+                raise
+            finally:
+                if log is not None:
+                    log.close(returncode)
+                if stats_before is not None:
+                    self.print_compiler_cache_stats(cache_backend,
+                                                    stats_before)
+            self.print_link_times(directory, log_position)
+            return log_position
+
+    @staticmethod
+    def build_log_keep():
+        return 10
+
+    # one directory of logs per build directory, directories with the same
+    # name in different places get their own
+    def build_log_dir(self, directory):
+        directory = os.path.abspath(directory)
+        return os.path.join(
+            self.cache_dir(), "logs", "{}-{}".format(
+                os.path.basename(directory),
+                hash_json(directory)[:12]))
+
+    def print_link_times(self, directory, position=None):
+        from cmake_cli import ninja_log
+
+        history = ninja_log.record_link_times(
+            directory,
+            self.configured_linker(directory),
+            ninja_file=self.ninja_file(directory),
+            position=position)
+        if history is not None:
+            print(ninja_log.format_link_times(history))
+
+    # the difference of the cache's counters over this build, builds running
+    # at the same time with the same cache are counted too
+    @staticmethod
+    def print_compiler_cache_stats(backend, stats_before):
+        from cmake_cli import compiler_cache
 
-            self.piped_runner([build_cmd + native_build_tool_args] +
-                              piped_commands,
-                              env=build_env)
+        delta = compiler_cache.stats_delta(stats_before, backend.stats())
+        if delta is not None:
+            print(compiler_cache.format_stats(backend.name, delta))
 
     def build_default_command_parser(self,
                                      parser,
@@ -252,6 +844,34 @@ class BaseCMakeBuilder():
                                                never_built=never_built,
                                                **kwargs)
 
+    @staticmethod
+    def release_add_args(parser, release_default=False):
+        parser.add_argument('--release',
+                            default=release_default,
+                            dest='release',
+                            action='store_true')
+        parser.add_argument('--debug', dest='release', action='store_false')
+        parser.add_argument('--release-debug-info',
+                            default=False,
+                            dest='release_debug_info',
+                            action='store_true',
+                            help='enable debug info for release build')
+        parser.add_argument('--no-release-debug-info',
+                            default=False,
+                            dest='release_debug_info',
+                            action='store_false')
+        parser.add_argument(
+            '--multi-config',
+            dest='multi_config',
+            action='store_true',
+            default=None,
+            help='one Ninja Multi-Config build directory shared by every '
+            'build type, which is picked at build time')
+        parser.add_argument('--no-multi-config',
+                            dest='multi_config',
+                            action='store_false',
+                            default=None)
+
     def build_default_command_parser_impl(
             self,
             parser,
@@ -272,38 +892,84 @@ class BaseCMakeBuilder():
                     '--generator',
                     default='Ninja',
                     help='cmake generator (Ninja, Unix Makefiles, ...)')
+                parser.add_argument(
+                    '--linker',
+                    choices=['auto', 'default'] +
+                    [name for name, _ in self.linkers()],
+                    default=None,
+                    help='linker to use (auto picks the first installed, '
+                    'default is the compiler\'s)')
+                parser.add_argument(
+                    '--unity',
+                    dest='unity',
+                    action='store_true',
+                    default=None,
+                    help='unity build (default: the setting found by '
+                    'unity_tune, if any)')
+                parser.add_argument('--no-unity',
+                                    dest='unity',
+                                    action='store_false',
+                                    default=None)
+                parser.add_argument('--unity-batch-size',
+                                    type=int,
+                                    default=None,
+                                    help='sources per unity source, 0 for '
+                                    'all of a target (implies --unity)')
             if has_ccache:
                 parser.add_argument('--ccache',
                                     dest='ccache',
                                     action='store_true',
                                     default=self.ccache_default(),
-                                    help='use ccache')
+                                    help='use a compiler cache (ccache or '
+                                    'sccache)')
                 parser.add_argument('--no-ccache',
                                     dest='ccache',
                                     action='store_false',
                                     default=self.ccache_default(),
                                     help="don't use ccache")
+                parser.add_argument(
+                    '--compiler-cache',
+                    choices=['auto', 'ccache', 'sccache'],
+                    default=None,
+                    help='compiler cache to use (implies --ccache, auto '
+                    'picks the first installed)')
             parser.add_argument('--source-dir', help='source directory')
 
             parser.add_argument(
                 '--gen-args', help='additional arguments for cmake generation')
+            parser.add_argument(
+                '--track-memory',
+                dest='track_memory',
+                action='store_true',
+                default=False,
+                help='record the peak memory of each compile and link so '
+                'later builds can limit jobs to what fits in memory')
+            parser.add_argument('--no-track-memory',
+                                dest='track_memory',
+                                action='store_false')
+            parser.add_argument(
+                '--force-gen',
+                action='store_true',
+                help='generate even if the build directory is up to date')
+            parser.add_argument(
+                '--profile-configure',
+                action='store_true',
+                help='regenerate with CMake\'s profiling and summarize the '
+                'slowest files, commands, find_package calls and checks')
+            parser.add_argument(
+                '--seed',
+                dest='seed',
+                action='store_true',
+                default=None,
+                help='configure new build directories starting from the '
+                'compiler detection and checks of a compatible configured '
+                'one')
+            parser.add_argument('--no-seed',
+                                dest='seed',
+                                action='store_false',
+                                default=None)
             if has_release:
-                parser.add_argument('--release',
-                                    default=release_default,
-                                    dest='release',
-                                    action='store_true')
-                parser.add_argument('--debug',
-                                    dest='release',
-                                    action='store_false')
-                parser.add_argument('--release-debug-info',
-                                    default=False,
-                                    dest='release_debug_info',
-                                    action='store_true',
-                                    help='enable debug info for release build')
-                parser.add_argument('--no-release-debug-info',
-                                    default=False,
-                                    dest='release_debug_info',
-                                    action='store_false')
+                self.release_add_args(parser, release_default=release_default)
 
             if has_build_testing:
                 parser.add_argument('--build-testing',
@@ -328,6 +994,12 @@ class BaseCMakeBuilder():
                                 type=int,
                                 default=None,
                                 help='set num threads')
+            parser.add_argument(
+                '--no-auto-jobs',
+                dest='auto_jobs',
+                action='store_false',
+                help="without -j, don't pick the job count from cpu quota, "
+                "affinity and learned memory use")
             parser.add_argument('-k',
                                 '--keep-going',
                                 action='store_true',
@@ -351,6 +1023,21 @@ class BaseCMakeBuilder():
                                 action='store_false',
                                 dest='force_color',
                                 default=False)
+            parser.add_argument(
+                '--no-build-log',
+                dest='build_log',
+                action='store_false',
+                help="don't keep the output in the log errors reads")
+            parser.add_argument(
+                '--raw-output',
+                action='store_true',
+                help="pass build output through as is, don't collapse "
+                "progress lines or summarize diagnostics")
+            parser.add_argument(
+                '--max-diagnostics',
+                type=int,
+                default=5,
+                help='compiler diagnostics to repeat if the build fails')
             parser.add_argument('--build-args',
                                 help='additional args for cmake building')
             parser.add_argument(
@@ -377,7 +1064,9 @@ class BaseCMakeBuilder():
             return self.args.directory
 
         if forced_base is None:
-            if self.args.release:
+            if self.multi_config():
+                base = "multi"
+            elif self.args.release:
                 base = "release"
                 if self.args.release_debug_info:
                     base += "_deb_info"
@@ -396,111 +1085,1108 @@ class BaseCMakeBuilder():
             parser,
             has_build_testing=self.has_build_testing_default(),
             build_testing_default=self.build_testing_default(),
+            has_ccache=True,
         )
         parser.add_argument('--target', help='cmake target')
+        parser.add_argument('--report',
+                            nargs='?',
+                            const='table',
+                            choices=['table', 'json'],
+                            help='report slow build steps after building '
+                            '(Ninja only)')
+        parser.add_argument(
+            '--affected',
+            nargs='?',
+            const='HEAD',
+            default=None,
+            metavar='REV',
+            help='only build targets affected by C-family files changed '
+            'since REV (default HEAD, Ninja only)')
+
+    # None if there isn't enough dependency data to tell
+    def affected_targets(self, directory, rev):
+        from cmake_cli import ninja_deps
+
+        if not (os.path.exists(os.path.join(directory, "build.ninja"))
+                and os.path.exists(os.path.join(directory, ".ninja_deps"))):
+            return None
+        changed = self.git_diff_find_c_family_files(rev)
+        if not changed:
+            return []
+        return ninja_deps.affected_targets(directory, changed,
+                                          self.ninja_file(directory))
+
+    # changes the dependency data can't map to targets: CMake files and
+    # deleted sources or headers
+    def unmapped_changes(self, rev):
+        from cmake_cli.file_discovery import git_diff_names
+
+        self.check_needed("can't diff, ", ["git"])
+        return (git_diff_names(rev, "ACMRD",
+                               ["*CMakeLists.txt", "*.cmake"]) +
+                git_diff_names(
+                    rev, "D",
+                    ["*." + ext for ext in self.c_family_file_extensions()]))
 
     def build_command(self):
         additional_build_args = None
         if self.args.target is not None:
             additional_build_args = ["--target", self.args.target]
 
-        self.build(self.get_directory(),
-                   additional_build_args=additional_build_args)
+        if self.args.affected is not None:
+            if self.args.target is not None:
+                print("--affected and --target can't be used together")
+                sys.exit(1)
+            unmapped = self.unmapped_changes(self.args.affected)
+            targets = None
+            if not unmapped:
+                targets = self.affected_targets(self.get_directory(),
+                                                self.args.affected)
+            if unmapped:
+                print("CMake files or deleted files changed since",
+                      self.args.affected, "({}), building everything".format(
+                          ", ".join(unmapped)))
+            elif targets is None:
+                print("no Ninja dependency data in", self.get_directory(),
+                      "yet, building everything")
+            elif not targets:
+                print("no targets affected by changes since",
+                      self.args.affected)
+                return
+            else:
+                print("affected targets:", " ".join(targets))
+                additional_build_args = ["--target"] + targets
+
+        position = self.build(self.get_directory(),
+                              additional_build_args=additional_build_args)
+
+        if self.args.report is not None:
+            self.print_build_report(self.get_directory(),
+                                    self.args.report == 'json',
+                                    position=position)
+
+    def report_jobs(self):
+        with suppress(AttributeError):
+            if self.args.threads is not None:
+                return self.args.threads
+        return resources.cpu_limit()
+
+    # position is where the log ended before the build to report on, without
+    # it the last build is told apart from the earlier ones by its times
+    def print_build_report(self, directory, as_json, top=10, position=None):
+        from cmake_cli import ninja_log
+
+        if not os.path.exists(ninja_log.log_path(directory)):
+            print("no .ninja_log in", directory,
+                  "- reports need the Ninja generator")
+            sys.exit(1)
+        report = ninja_log.report_with_deltas(
+            directory,
+            self.report_jobs(),
+            top=top,
+            ninja_file=self.ninja_file(directory),
+            position=position)
+        if report is None:
+            if position is not None:
+                print("nothing was built, no report")
+                return
+            print("no builds recorded in", ninja_log.log_path(directory))
+            sys.exit(1)
+        if as_json:
+            print(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            print(ninja_log.format_report(report))
+
+    def build_report_add_args(self, parser):
+        parser.description = 'report slow steps of the last Ninja build'
+        parser.add_argument('--directory', help='force specific directory')
+        self.release_add_args(parser)
+        parser.add_argument('-j',
+                            '--threads',
+                            type=int,
+                            default=None,
+                            help='jobs the build ran with')
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--top',
+                            type=int,
+                            default=10,
+                            help='number of entries in each table')
+
+    def build_report_command(self):
+        self.print_build_report(self.get_directory(),
+                                self.args.json,
+                                top=self.args.top)
+
+    def header_cost_add_args(self, parser):
+        parser.description = ('rank headers by the compile time a change to '
+                              'them rebuilds, from Ninja\'s dependency data')
+        parser.add_argument('--directory', help='force specific directory')
+        self.release_add_args(parser)
+        parser.add_argument('--source-dir',
+                            help='only headers under this directory '
+                            '(default: the current one)')
+        parser.add_argument('--all-headers',
+                            action='store_true',
+                            help='include system and other headers outside '
+                            'the source directory')
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--top',
+                            type=int,
+                            default=20,
+                            help='number of headers to show')
+
+    def header_cost_command(self):
+        from cmake_cli import header_cost
+
+        directory = self.get_directory()
+        if not os.path.exists(os.path.join(directory, ".ninja_deps")):
+            print("no .ninja_deps in", directory,
+                  "- header costs need a Ninja build")
+            sys.exit(1)
+
+        under = None
+        if not self.args.all_headers:
+            under = os.path.abspath(self.args.source_dir or ".")
+        index = header_cost.load_index(directory,
+                                       self.ninja_file(directory))
+        result = header_cost.report(index, top=self.args.top, under=under)
+        if self.args.json:
+            print(json.dumps(result, indent=2, sort_keys=True))
+        else:
+            for h in result["headers"]:
+                relative = os.path.relpath(h["header"])
+                if not relative.startswith(".."):
+                    h["header"] = relative
+            print(header_cost.format_report(result))
+
+    def errors_add_args(self, parser):
+        parser.description = ('show diagnostics from the log of an earlier '
+                              'build')
+        parser.add_argument('--directory', help='force specific directory')
+        self.release_add_args(parser)
+        parser.add_argument('--file',
+                            help='only diagnostics in this file (a path or '
+                            'its end)')
+        parser.add_argument('-n',
+                            '--count',
+                            type=int,
+                            default=10,
+                            help='diagnostics to show, 0 for all')
+        parser.add_argument('--severity',
+                            choices=['error', 'warning', 'all'],
+                            default='error',
+                            help='error includes fatal errors')
+        parser.add_argument('--build',
+                            type=int,
+                            default=0,
+                            help='how many builds back, 0 is the latest')
+        parser.add_argument('--log',
+                            action='store_true',
+                            help='print the whole log of the build')
+
+    def errors_command(self):
+        from cmake_cli import build_log
+
+        directory = self.get_directory()
+        log_dir = self.build_log_dir(directory)
+        indexed = [
+            b for b in build_log.builds(log_dir)
+            if os.path.exists(os.path.join(log_dir, build_log.index_name(b)))
+        ]
+        if len(indexed) <= self.args.build:
+            print("no build log for", directory)
+            sys.exit(1)
+        build_id = indexed[-1 - self.args.build]
+        index = build_log.read_index(log_dir, build_id)
+
+        if self.args.log:
+            sys.stdout.write(build_log.read_log(log_dir, build_id))
+            return
+
+        positions = range(len(index["diagnostics"]))
+        if self.args.file is not None:
+            wanted = os.path.abspath(self.args.file)
+            suffix = os.sep + os.path.normpath(self.args.file)
+            positions = sorted(
+                i for path, found in index["files"].items()
+                if path == wanted or path.endswith(suffix) for i in found)
+        diagnostics = [index["diagnostics"][i] for i in positions]
+        if self.args.severity != 'all':
+            diagnostics = [
+                d for d in diagnostics
+                if (d["severity"] == "warning") == (
+                    self.args.severity == "warning")
+            ]
+        total = len(diagnostics)
+        if self.args.count > 0:
+            diagnostics = diagnostics[:self.args.count]
+
+        print("build {} {} ({}), {} lines of output".format(
+            build_id,
+            "succeeded" if index["returncode"] == 0 else "failed",
+            ", ".join("{} {}{}".format(n, severity, "s" if n != 1 else "")
+                      for severity, n in sorted(index["counts"].items()))
+            or "no diagnostics", index["lines"]))
+        for d in diagnostics:
+            location = "{}:{}".format(os.path.relpath(d["file"]), d["line"])
+            if d["column"] is not None:
+                location += ":{}".format(d["column"])
+            print("{}: {}: {}".format(location, d["severity"], d["message"]))
+            for line in d["context"]:
+                print(line)
+        if total > len(diagnostics):
+            print("... {} more (use -n 0 for all)".format(total -
+                                                         len(diagnostics)))
+
+    def test_add_args(self, parser):
+        parser.description = 'build and run tests with ctest'
+        self.build_default_command_parser(
+            parser,
+            has_build_testing=self.has_build_testing_default(),
+            build_testing_default=self.build_testing_default(),
+            has_ccache=True,
+        )
+        parser.add_argument('-R',
+                            '--tests-regex',
+                            help='only run tests matching this regex')
+        parser.add_argument('-E',
+                            '--exclude-regex',
+                            help="don't run tests matching this regex")
+        parser.add_argument('--failed',
+                            action='store_true',
+                            help='only rerun the tests which failed last time')
+        parser.add_argument('--test-jobs',
+                            type=int,
+                            default=None,
+                            help='tests run at once (default: cpus available '
+                            'to this process)')
+        parser.add_argument('--test-load',
+                            type=float,
+                            default=None,
+                            help="don't start tests while the cpu load is "
+                            "above this")
+        parser.add_argument('--no-output-on-failure',
+                            dest='output_on_failure',
+                            action='store_false',
+                            help="don't print the output of failed tests")
+        parser.add_argument('--ctest-args',
+                            help='additional arguments for ctest')
+
+    # LastTestsFailed.log is only rewritten when tests fail, the failures
+    # after "---" in CTestCostData.txt are from the last run
+    @staticmethod
+    def last_failed_tests(directory):
+        path = os.path.join(directory, "Testing", "Temporary",
+                            "CTestCostData.txt")
+        with suppress(OSError):
+            with open(path) as f:
+                lines = f.read().splitlines()
+            if "---" in lines:
+                return [t for t in lines[lines.index("---") + 1:] if t]
+        return []
+
+    # ctest schedules the tests which took longest in earlier runs first
+    # when running in parallel, using the durations it records in
+    # Testing/Temporary/CTestCostData.txt
+    def get_ctest_cmd(self, directory):
+        jobs = self.args.test_jobs
+        if jobs is None:
+            jobs = resources.cpu_limit()
+        ctest_cmd = self.ctest_command() + ["-j", str(jobs)]
+        if self.is_multi_config(directory):
+            ctest_cmd += ["-C", self.build_config()]
+        if self.args.test_load is not None:
+            ctest_cmd += ["--test-load", str(self.args.test_load)]
+        if self.args.output_on_failure:
+            ctest_cmd.append("--output-on-failure")
+        if self.args.failed:
+            ctest_cmd.append("--rerun-failed")
+        if self.args.tests_regex is not None:
+            ctest_cmd += ["-R", self.args.tests_regex]
+        if self.args.exclude_regex is not None:
+            ctest_cmd += ["-E", self.args.exclude_regex]
+        self.append_args(ctest_cmd, self.args.ctest_args)
+        return ctest_cmd
+
+    def test_command(self):
+        directory = self.get_directory()
+        if self.args.failed and not self.last_failed_tests(directory):
+            print("no tests failed in the last run in", directory)
+            return
+
+        # same arguments as build (so switching between them doesn't
+        # regenerate) unless the directory was configured without tests
+        with suppress(AttributeError):
+            if (self.args.build_testing is None
+                    and self.read_cmake_cache(directory).get(
+                        "BUILD_TESTING", "").upper()
+                    in ["OFF", "0", "NO", "FALSE", "N"]):
+                self.args.build_testing = True
+
+        self.build(directory)
+
+        ctest_cmd = self.get_ctest_cmd(directory)
+        print("running:", ctest_cmd, flush=True)
+        try:
+            returncode = subprocess.run(ctest_cmd, cwd=directory).returncode
+        except KeyboardInterrupt:
+            sys.exit(1)
+        if returncode != 0:
+            sys.exit(returncode)
+
+    def unity_tune_add_args(self, parser):
+        parser.description = ('time unity builds with several batch sizes '
+                              'in scratch build directories and use the '
+                              'best in later builds')
+        self.build_default_command_parser(
+            parser,
+            has_build_testing=self.has_build_testing_default(),
+            build_testing_default=self.build_testing_default(),
+        )
+        parser.add_argument('--batch-sizes',
+                            nargs='+',
+                            type=int,
+                            default=[8, 16, 32, 64],
+                            help='batch sizes to try, a build without unity '
+                            'is always tried too')
+        parser.add_argument('--target', help='cmake target')
+        parser.add_argument('--keep-dirs',
+                            action='store_true',
+                            help="don't remove the scratch build directories")
+
+    # the scratch build with batch_size, returns the measurements
+    def unity_tune_build(self, unity, batch_size, build_type,
+                         additional_build_args):
+        self.args.unity = unity
+        self.args.unity_batch_size = batch_size
+        label = "batch size {}".format(batch_size) if unity else "no unity"
+        directory = os.path.join(
+            self.base_build_dir(),
+            "unity_tune_" + (str(batch_size) if unity else "off"))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+        log = os.path.join(directory, "cmake_cli_unity_tune.log")
+        with open(log, "w") as output:
+            try:
+                self.gen(directory,
+                         self.get_gen_cmd(directory, build_type),
+                         force_gen=True,
+                         output=output)
+            except SystemExit:
+                print(label, "failed to generate, see", log)
+                raise
+            build_cmd = self.get_build_cmd(directory,
+                                           additional_build_args,
+                                           threads=self.args.threads)
+            returncode, elapsed, peak = resources.run_measured(build_cmd,
+                                                               output=output)
+        if returncode != 0:
+            print(label, "failed to build, see", log)
+            sys.exit(returncode)
+        print("{}: {:.1f}s, peak {} MiB".format(label, elapsed, peak >> 20),
+              flush=True)
+
+        if not self.args.keep_dirs:
+            shutil.rmtree(directory)
+        return {
+            "unity": unity,
+            "batch_size": batch_size,
+            "time": elapsed,
+            "peak": peak,
+        }
+
+    def unity_tune_command(self):
+        build_type = self.get_build_type(self.args.release,
+                                         self.args.release_debug_info)
+        additional_build_args = None
+        if self.args.target is not None:
+            additional_build_args = ["--target", self.args.target]
+
+        results = [
+            self.unity_tune_build(unity, batch_size, build_type,
+                                  additional_build_args)
+            for unity, batch_size in [(False, None)] +
+            [(True, size) for size in self.args.batch_sizes]
+        ]
+
+        # the fastest setting whose heaviest process still fits in memory
+        # once per job
+        total, _ = resources.memory_limits()
+        jobs = self.args.threads or resources.cpu_limit()
+        fits = [
+            r for r in results if total is None or r["peak"] * jobs <= total
+        ]
+        best = min(fits or results, key=lambda r: r["time"])
+
+        tuned = load_json(self.unity_tune_path(), {})
+        tuned[self.project_key()] = {
+            "unity": best["unity"],
+            "batch_size": best["batch_size"],
+            "results": results,
+        }
+        atomic_write_json(self.unity_tune_path(), tuned)
+        if best["unity"]:
+            print("later builds use unity builds with batch size",
+                  best["batch_size"])
+        else:
+            print("later builds don't use unity builds")
+        print("(--unity, --no-unity and --unity-batch-size still override "
+              "this)")
+
+    @staticmethod
+    def matrix_configs():
+        return ["debug", "release", "release_deb_info"]
+
+    # list of (directory suffix, additional gen args), defaults to just
+    # extend_directory()
+    def matrix_variants(self):
+        return [(self.extend_directory(), [])]
+
+    def matrix_add_args(self, parser):
+        parser.description = ('configure and build several configurations '
+                              'concurrently')
+        self.build_default_command_parser(
+            parser,
+            has_release=False,
+            has_build_testing=self.has_build_testing_default(),
+            build_testing_default=self.build_testing_default(),
+            has_ccache=True,
+        )
+        parser.add_argument('--configs',
+                            nargs='+',
+                            choices=self.matrix_configs(),
+                            default=['debug', 'release'],
+                            help='configurations to build')
+        parser.add_argument(
+            '--compilers',
+            nargs='+',
+            default=None,
+            help='compilers to build with, as CC:CXX (for example gcc:g++)')
+        parser.add_argument('--max-concurrent',
+                            type=int,
+                            default=None,
+                            help='max configurations built at once')
+        parser.add_argument('--target', help='cmake target')
+
+    def matrix_entries(self):
+        compilers = [None]
+        if self.args.compilers is not None:
+            compilers = self.args.compilers
+
+        entries = []
+        for config in self.args.configs:
+            for compiler in compilers:
+                for suffix, gen_args in self.matrix_variants():
+                    name = config
+                    env = None
+                    if compiler is not None:
+                        cc, _, cxx = compiler.partition(":")
+                        env = dict(os.environ, CC=cc)
+                        if cxx:
+                            env["CXX"] = cxx
+                        name += "_" + os.path.basename(cc)
+                    name += suffix
+                    entries.append({
+                        "name": name,
+                        "config": config,
+                        "directory": os.path.join(self.base_build_dir(),
+                                                  name),
+                        "env": env,
+                        "gen_args": gen_args,
+                    })
+
+        return entries
+
+    def matrix_build_entry(self, entry, threads, builds, build_slots,
+                           additional_build_args):
+        result = {
+            "name": entry["name"],
+            "directory": entry["directory"],
+            "log": os.path.join(entry["directory"], "cmake_cli_matrix.log"),
+            "returncode": 0,
+            "gen_time": None,
+            "build_time": None,
+        }
+        os.makedirs(entry["directory"], exist_ok=True)
+        with open(result["log"], "w") as output:
+            try:
+                config = entry["config"]
+                build_type = self.get_build_type(config != "debug",
+                                                 config == "release_deb_info")
+                gen_cmd = self.get_gen_cmd(entry["directory"], build_type,
+                                           entry["gen_args"])
+                start = time.time()
+                self.gen(entry["directory"],
+                         gen_cmd,
+                         force_gen=self.args.force_gen,
+                         env=entry["env"],
+                         output=output)
+                result["gen_time"] = time.time() - start
+
+                if self.args.threads is None and self.args.auto_jobs:
+                    # each concurrent build gets its share of the memory
+                    threads = min(
+                        threads,
+                        max(1,
+                            resources.auto_jobs(entry["directory"]) //
+                            builds))
+                build_cmd = self.get_build_cmd(entry["directory"],
+                                               additional_build_args,
+                                               threads=threads)
+                env = entry["env"]
+                cache_env = self.compiler_cache_env()
+                if cache_env:
+                    env = dict(env or os.environ, **cache_env)
+                with build_slots:
+                    start = time.time()
+                    self.runner(build_cmd, env=env, output=output)
+                    result["build_time"] = time.time() - start
+            except SystemExit as e:
+                result["returncode"] = e.code
+
+        return result
+
+    def matrix_command(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        entries = self.matrix_entries()
+
+        concurrent = len(entries)
+        if self.args.max_concurrent is not None:
+            concurrent = max(1, min(concurrent, self.args.max_concurrent))
+
+        total_threads = self.args.threads
+        if total_threads is None:
+            total_threads = resources.cpu_limit()
+        # configures run side by side, but no more builds than threads so
+        # each gets at least one without oversubscribing the machine
+        builds = max(1, min(concurrent, total_threads))
+        threads = max(1, total_threads // builds)
+        build_slots = threading.BoundedSemaphore(builds)
+
+        additional_build_args = None
+        if self.args.target is not None:
+            additional_build_args = ["--target", self.args.target]
+
+        print("building {} configurations, {} at a time with {} threads "
+              "each".format(len(entries), builds, threads))
+
+        with ThreadPoolExecutor(max_workers=concurrent) as executor:
+            results = list(
+                executor.map(
+                    lambda entry: self.matrix_build_entry(
+                        entry, threads, builds, build_slots,
+                        additional_build_args), entries))
+
+        def format_time(t):
+            return "-" if t is None else "{:.1f}s".format(t)
+
+        name_width = max(len(r["name"]) for r in results)
+        print("{}  {:>6}  {:>9}  {:>9}".format("config".ljust(name_width),
+                                                "status", "configure",
+                                                "build"))
+        for r in results:
+            print("{}  {:>6}  {:>9}  {:>9}".format(
+                r["name"].ljust(name_width),
+                "ok" if r["returncode"] == 0 else "FAILED",
+                format_time(r["gen_time"]), format_time(r["build_time"])))
+
+        failed = [r for r in results if r["returncode"] != 0]
+        for r in failed:
+            print("see", r["log"], "for", r["name"], "output")
+        if failed:
+            sys.exit(1)
+
+    def watch_add_args(self, parser):
+        parser.description = 'rebuild when sources change'
+        self.build_default_command_parser(
+            parser,
+            has_build_testing=self.has_build_testing_default(),
+            build_testing_default=self.build_testing_default(),
+            has_ccache=True,
+        )
+        parser.add_argument('--target', help='cmake target')
+        parser.add_argument('--debounce',
+                            type=int,
+                            default=200,
+                            help='ms without changes before rebuilding')
+        parser.add_argument('--poll',
+                            action='store_true',
+                            help='poll for changes instead of using inotify')
+        parser.add_argument('--poll-interval',
+                            type=float,
+                            default=1.0,
+                            help='seconds between polls')
+
+    def watch_index_path(self):
+        return os.path.join(self.cache_dir(), "watch_index.json")
+
+    @staticmethod
+    def is_cmake_file(path):
+        return (os.path.basename(path) == "CMakeLists.txt"
+                or path.endswith(".cmake"))
+
+    def watch_command(self):
+        from cmake_cli import watch
+        from cmake_cli.file_discovery import find_files
+
+        directory = self.get_directory()
+        root = "." if self.args.source_dir is None else self.args.source_dir
+
+        gen_cmd = None
+        if not self.args.skip_gen:
+            build_type = self.get_build_type(self.args.release,
+                                             self.args.release_debug_info)
+            gen_cmd = self.get_gen_cmd(directory, build_type)
+            self.gen(directory, gen_cmd, force_gen=self.args.force_gen)
+
+        additional_build_args = None
+        if self.args.target is not None:
+            additional_build_args = ["--target", self.args.target]
+        build_cmd = self.get_build_cmd(directory,
+                                       additional_build_args,
+                                       threads=self.args.threads)
+
+        extensions = set(self.c_family_file_extensions())
+        excluded = [
+            os.path.abspath(d) for d in [self.base_build_dir(), directory]
+        ]
+
+        def should_watch(path):
+            path = os.path.abspath(path)
+            return not (os.path.basename(path).startswith(".") or any(
+                path == e or path.startswith(e + os.sep) for e in excluded))
+
+        def is_relevant(path):
+            return path == watch.overflowed or (
+                should_watch(path) and
+                (self.is_cmake_file(path)
+                 or os.path.splitext(path)[1][1:] in extensions))
+
+        def list_files(with_dirs=False):
+            return find_files(list(extensions) + ["cmake"],
+                              root=root,
+                              index_path=self.watch_index_path(),
+                              names=["CMakeLists.txt"],
+                              with_dirs=with_dirs)
+
+        watcher = None
+        if not self.args.poll:
+            try:
+                _, dirs = list_files(with_dirs=True)
+                watcher = watch.InotifyWatcher(
+                    os.path.join(root, d) for d in dirs
+                    if should_watch(os.path.join(root, d)))
+            except (OSError, AttributeError) as e:
+                print("WARN: can't use inotify ({}), polling instead".format(
+                    e))
+        if watcher is None:
+            # find_files returns paths relative to root
+            watcher = watch.PollingWatcher(
+                lambda: [
+                    os.path.join(root, f) for f in list_files()
+                    if should_watch(os.path.join(root, f))
+                ], self.args.poll_interval)
+
+        def relevant_changes(timeout):
+            return set(p for p in watcher.wait(timeout, should_watch)
+                       if is_relevant(p))
+
+        env = None
+        cache_env = self.compiler_cache_env()
+        if cache_env:
+            env = dict(os.environ, **cache_env)
+
+        job = watch.BuildJob([build_cmd], env)
+        reported = False
+        try:
+            while True:
+                changed = relevant_changes(0.5)
+                if job.done() and not reported:
+                    reported = True
+                    print("build {} in {:.1f}s, watching for changes".format(
+                        "succeeded" if job.returncode == 0 else
+                        "failed ({})".format(job.returncode),
+                        time.time() - job.start),
+                          flush=True)
+                if not changed:
+                    continue
+
+                # wait for the burst of changes (save all, git checkout) to
+                # end before building
+                while True:
+                    more = relevant_changes(self.args.debounce / 1000)
+                    if not more:
+                        break
+                    changed |= more
+
+                if not job.done():
+                    print("changes detected, cancelling build", flush=True)
+                    job.cancel()
+
+                cmds = [build_cmd]
+                if gen_cmd is not None and any(
+                        p == watch.overflowed or self.is_cmake_file(p)
+                        for p in changed):
+                    cmds = [gen_cmd, build_cmd]
+                print("{} files changed, rebuilding".format(len(changed)),
+                      flush=True)
+                job = watch.BuildJob(cmds, env)
+                reported = False
+        except KeyboardInterrupt:
+            if not job.done():
+                job.cancel()
+            raise
+        finally:
+            watcher.close()
 
     def cc_add_args(self, parser):
         parser.description = 'generate compile_commands.json'
         self.build_default_command_parser(parser,
                                           has_release=False,
                                           never_built=True)
+        parser.add_argument(
+            '--merge',
+            action='store_true',
+            help='merge the databases of every configured build directory')
+        parser.add_argument('--from',
+                            dest='from_dirs',
+                            nargs='+',
+                            default=None,
+                            help='merge the databases of these build '
+                            'directories')
+
+    def cc_default_directory(self):
+        return os.path.join(self.base_build_dir(), "compile_commands_dir")
+
+    # configured build directories, most preferred first
+    def configured_directories(self):
+        preferred = [self.cc_default_directory()] + [
+            os.path.join(self.base_build_dir(), base + self.extend_directory())
+            for base in ["debug", "release_deb_info", "release", "multi"]
+        ]
+        others = []
+        with suppress(OSError):
+            others = sorted(
+                os.path.join(self.base_build_dir(), d)
+                for d in os.listdir(self.base_build_dir()))
+        out = []
+        for directory in preferred + others:
+            if (directory not in out and os.path.exists(
+                    os.path.join(directory, "CMakeCache.txt"))):
+                out.append(directory)
+        return out
+
+    # reconfigures an existing build directory without touching its other
+    # settings if it wasn't exporting compile commands
+    def ensure_compile_commands(self, directory):
+        from cmake_cli import compile_db
+
+        if not os.path.exists(compile_db.db_path(directory)):
+            self.runner(self.cmake_command() +
+                        ["-DCMAKE_EXPORT_COMPILE_COMMANDS=YES", directory])
+        return compile_db.db_path(directory)
+
+    def cc_state_path(self):
+        return os.path.join(self.cache_dir(), "compile_commands.json")
 
     def cc_command(self):
-        directory = os.path.join(self.base_build_dir(), "compile_commands_dir")
+        from cmake_cli import compile_db
+
+        if self.args.from_dirs is not None or self.args.merge:
+            directories = self.args.from_dirs
+            if directories is None:
+                directories = self.configured_directories()
+            if not directories:
+                print("no configured build directories to merge")
+                sys.exit(1)
+            paths = [self.ensure_compile_commands(d) for d in directories]
+            compile_db.write_merged(paths, compile_db.file_name,
+                                    self.cc_state_path())
+            return
+
+        directory = self.cc_directory()
+        compile_db.link(self.prepare_compile_commands(directory),
+                        compile_db.file_name, self.cc_state_path())
+
+    def cc_directory(self):
         if self.args.directory is not None:
-            directory = self.args.directory
-        self.build(directory,
-                   additional_gen_args=["-DCMAKE_EXPORT_COMPILE_COMMANDS=YES"],
-                   skip_build=True)
-        if os.path.exists("compile_commands.json"):
-            print("compile_commands.json exists - not overriding")
+            return self.args.directory
+        configured = self.configured_directories()
+        return configured[0] if configured else self.cc_default_directory()
+
+    def prepare_compile_commands(self, directory):
+        from cmake_cli import compile_db
+
+        if os.path.exists(os.path.join(directory, "CMakeCache.txt")):
+            path = self.ensure_compile_commands(directory)
         else:
-            os.symlink(os.path.join(directory, "compile_commands.json"),
-                       "compile_commands.json")
+            self.build(
+                directory,
+                additional_gen_args=["-DCMAKE_EXPORT_COMPILE_COMMANDS=YES"],
+                skip_build=True)
+            path = compile_db.db_path(directory)
+        if self.is_multi_config(directory):
+            # every build type compiles each file, tools should see one
+            path = compile_db.write_config(path, self.build_config())
+        return path
+
+    def tidy_add_args(self, parser):
+        parser.description = ('run clang-tidy on the files in the compile '
+                              'database')
+        self.build_default_command_parser(parser,
+                                          has_release=False,
+                                          never_built=True)
+        parser.add_argument('--clang-tidy-args', default="")
+        parser.add_argument('--diff',
+                            nargs='?',
+                            const='',
+                            default=None,
+                            metavar='REV',
+                            help='only files changed (since REV)')
+        parser.add_argument('--staged',
+                            action='store_true',
+                            help='only staged files')
+        parser.add_argument('-j',
+                            '--jobs',
+                            type=int,
+                            default=None,
+                            help='number of clang-tidy processes')
+        parser.add_argument('--no-tidy-cache',
+                            dest='tidy_cache',
+                            action='store_false',
+                            help="don't reuse results for unchanged files")
+
+    def tidy_cache_path(self, directory):
+        return os.path.join(directory, "cmake_cli_tidy.json")
+
+    def tidy_command(self):
+        from cmake_cli import compile_db
+        from cmake_cli.tidy_engine import tidy_files
+
+        self.check_needed("can't run clang-tidy, ", ["clang-tidy"])
 
-    @staticmethod
-    def clean_add_args(parser):
+        if self.args.staged:
+            files = self.git_diff_find_c_family_files('--cached')
+        elif self.args.diff is not None:
+            files = self.git_diff_find_c_family_files(self.args.diff)
+        else:
+            files = self.find_c_family_files()
+        wanted = set(os.path.abspath(f) for f in files)
+
+        directory = self.cc_directory()
+        db = self.prepare_compile_commands(directory)
+        with open(db) as f:
+            entries = [
+                e for e in json.load(f)
+                if compile_db.entry_source(e) in wanted
+            ]
+
+        cache_path = None
+        if self.args.tidy_cache:
+            cache_path = self.tidy_cache_path(directory)
+        jobs = self.args.jobs
+        if jobs is None:
+            jobs = resources.cpu_limit()
+        returncode = tidy_files(entries,
+                                directory,
+                                self.args.clang_tidy_args,
+                                cache_path=cache_path,
+                                jobs=jobs)
+        if returncode != 0:
+            sys.exit(returncode)
+
+    def clean_add_args(self, parser):
         parser.description = 'clean project'
+        # no choices=, argparse rejects an empty list for nargs='*' then
+        parser.add_argument('configs',
+                            nargs='*',
+                            metavar='CONFIG',
+                            help='configurations to clean: {} (default: '
+                            'the whole build directory)'.format(', '.join(
+                                self.clean_configs())))
+        parser.add_argument('--directory', help='clean a specific directory')
+        parser.add_argument(
+            '--objects',
+            action='store_true',
+            help='only remove object files and their depfiles, keeping '
+            'CMakeCache.txt and the generated build system')
+        parser.add_argument('--wait',
+                            action='store_true',
+                            help='delete in parallel before returning '
+                            'instead of in the background')
+
+    # the per build type directories and the shared multi-config one
+    def clean_configs(self):
+        return self.matrix_configs() + ["multi"]
+
+    # inside the build directory so moving there is a rename
+    def trash_dir(self):
+        return os.path.join(self.base_build_dir(), ".cmake_cli_trash")
+
+    # the files, not the CMakeFiles/<target>.dir directories: Makefile
+    # generators keep build.make, flags.make and friends next to them
+    @staticmethod
+    def object_files(directory):
+        out = []
+        for root, dirs, _ in os.walk(directory):
+            if os.path.basename(root) != "CMakeFiles":
+                continue
+            for d in dirs:
+                if not d.endswith(".dir"):
+                    continue
+                for target_root, _, names in os.walk(os.path.join(root, d)):
+                    out += [
+                        os.path.join(target_root, name) for name in names
+                        if name.endswith((".o", ".obj", ".o.d", ".obj.d"))
+                    ]
+            dirs[:] = [d for d in dirs if not d.endswith(".dir")]
+        return out
 
     def clean_command(self):
-        shutil.rmtree(self.base_build_dir(), ignore_errors=True)
+        from cmake_cli import trash
+
+        unknown = [
+            c for c in self.args.configs if c not in self.clean_configs()
+        ]
+        if unknown:
+            print("unknown configurations:", ", ".join(unknown))
+            sys.exit(1)
+
+        if self.args.directory is not None:
+            directories = [self.args.directory]
+        elif self.args.configs:
+            directories = [
+                os.path.join(self.base_build_dir(),
+                             config + self.extend_directory())
+                for config in self.args.configs
+            ]
+        elif self.args.objects:
+            directories = self.configured_directories()
+        else:
+            directories = []
+            with suppress(OSError):
+                directories = [
+                    os.path.join(self.base_build_dir(), name)
+                    for name in sorted(os.listdir(self.base_build_dir()))
+                    if name != os.path.basename(self.trash_dir())
+                ]
+
+        if self.args.objects:
+            paths = []
+            for directory in directories:
+                paths += self.object_files(directory)
+        else:
+            paths = [d for d in directories if os.path.lexists(d)]
+
+        if paths:
+            trash.move_to_trash(paths, self.trash_dir())
+            if self.args.objects:
+                print("removed {} object files from {}".format(
+                    len(paths), ", ".join(directories)))
+            else:
+                print("removed", ", ".join(paths))
+        else:
+            print("nothing to clean")
+        if not os.path.isdir(self.trash_dir()):
+            return
+
+        if self.args.wait:
+            trash.empty_trash(self.trash_dir())
+        else:
+            trash.empty_trash_in_background(self.trash_dir())
 
-    def find_c_family_files_command(self):
-        return (
-            'fd ' +
-            ' '.join(['-e ' + ext
-                      for ext in self.c_family_file_extensions()]), ['fd'])
+    def file_index_path(self):
+        return os.path.join(self.cache_dir(), "file_index.json")
+
+    # respects .gitignore and skips hidden files. This is the hook for which
+    # files are formatted and tidied: it returns paths, the shell
+    # command hooks it replaced are rejected by check_removed_hooks.
+    def find_c_family_files(self):
+        from cmake_cli.file_discovery import find_files
+
+        return find_files(self.c_family_file_extensions(),
+                          index_path=self.file_index_path())
+
+    def git_diff_find_c_family_files(self, args):
+        from cmake_cli.file_discovery import git_diff_files
+
+        self.check_needed("can't diff, ", ["git"])
+        return git_diff_files(args, self.c_family_file_extensions(),
+                              self.find_c_family_files())
 
     def check_needed(self, message, needed):
         has_needed = [self.exists_in_path(e) for e in needed]
         if not all(has_needed):
             print(message + "missing: ",
-                  ", ".join(e for e, has in zip(needed, has_needed) if has))
+                  ", ".join(e for e, has in zip(needed, has_needed)
+                            if not has))
             sys.exit(1)  # TODO: don't exit???
 
-    @staticmethod
-    def xargs_cmd():
-        return 'xargs --no-run-if-empty -n 1'
-
     # should formatting even be part of this project?
     @staticmethod
-    def format_add_args(parser):
+    def format_engine_add_args(parser):
+        parser.add_argument('-j',
+                            '--jobs',
+                            type=positive_int,
+                            default=None,
+                            help='number of clang-format processes')
+        parser.add_argument('--no-format-cache',
+                            dest='format_cache',
+                            action='store_false',
+                            help="don't skip files known to be formatted")
+
+    def format_add_args(self, parser):
         parser.description = 'format code with clang-format'
         parser.add_argument('--clang-format-args', default="-i")
+        self.format_engine_add_args(parser)
 
-    def base_format_command(self, find_cmd, base_needed):
-        needed = ["bash", "clang-format"]
-        needed += base_needed
-        self.check_needed("can't format, ", needed)
-        self.runner([
-            'bash', '-c',
-            '{0} | {1} clang-format {2}'.format(find_cmd, self.xargs_cmd(),
-                                                self.args.clang_format_args)
-        ])
+    def format_cache_path(self):
+        return os.path.join(self.cache_dir(), "format.json")
 
-    def format_command(self):
-        self.base_format_command(*self.find_c_family_files_command())
+    def base_format_command(self, files):
+        from cmake_cli.format_engine import format_files
 
-    def git_diff_find_c_family_files_cmd(self, args):
-        # use fd to read ignore file
-        return ("git diff " + args + " --name-only --diff-filter=ACMR " +
-                ' '.join([
-                    '"*.{}"'.format(ext)
-                    for ext in self.c_family_file_extensions()
-                ]) +
-                '| {} fd --fixed-strings --full-path'.format(self.xargs_cmd()),
-                ['git', 'fd'])
+        self.check_needed("can't format, ", ["clang-format"])
 
-    @staticmethod
-    def staged_format_check_add_args(parser):
+        cache_path = None
+        if self.args.format_cache:
+            cache_path = self.format_cache_path()
+        returncode = format_files(files,
+                                  self.args.clang_format_args,
+                                  cache_path=cache_path,
+                                  jobs=self.args.jobs)
+        if returncode != 0:
+            sys.exit(returncode)
+
+    def format_command(self):
+        self.base_format_command(self.find_c_family_files())
+
+    def staged_format_check_add_args(self, parser):
         parser.description = 'error if staged files need formating'
         parser.add_argument('--clang-format-args',
                             default="--dry-run --Werror")
+        self.format_engine_add_args(parser)
 
     def staged_format_check_command(self):
         self.base_format_command(
-            *self.git_diff_find_c_family_files_cmd('--cached'))
+            self.git_diff_find_c_family_files('--cached'))
 
-    @staticmethod
-    def format_diff_add_args(parser):
+    def format_diff_add_args(self, parser):
         parser.description = 'format files which have changed'
         parser.add_argument('--clang-format-args', default="-i")
         parser.add_argument('--staged', action='store_true')
+        self.format_engine_add_args(parser)
 
     def format_diff_command(self):
         diff_args = ''
         if self.args.staged:
             diff_args = 'HEAD~1'
         self.base_format_command(
-            *self.git_diff_find_c_family_files_cmd(diff_args))
+            self.git_diff_find_c_family_files(diff_args))
 
     @staticmethod
     def extend_main_parser(_):
@@ -513,7 +2199,17 @@ class BaseCMakeBuilder():
     def commands(self):
         commands = {
             "build": (self.build_add_args, self.build_command),
+            "matrix": (self.matrix_add_args, self.matrix_command),
+            "watch": (self.watch_add_args, self.watch_command),
+            "build_report":
+            (self.build_report_add_args, self.build_report_command),
+            "header_cost":
+            (self.header_cost_add_args, self.header_cost_command),
+            "test": (self.test_add_args, self.test_command),
+            "errors": (self.errors_add_args, self.errors_command),
+            "unity_tune": (self.unity_tune_add_args, self.unity_tune_command),
             "compile_commands": (self.cc_add_args, self.cc_command),
+            "tidy": (self.tidy_add_args, self.tidy_command),
             "clean": (self.clean_add_args, self.clean_command),
             "format": (self.format_add_args, self.format_command),
             "staged_format_check": (self.staged_format_check_add_args,
@@ -546,12 +2242,87 @@ class BaseCMakeBuilder():
             sys.exit(1)
         cmd()
 
+    # what each subcommand reads and writes: steps of a pipeline which
+    # don't conflict run at the same time. Subcommands missing here (like
+    # those added by extend_commands) run alone.
+    @staticmethod
+    def command_resources():
+        sources = {"sources"}
+        build = {"build"}
+        return {
+            "build": (sources, build),
+            "matrix": (sources, build),
+            "watch": (sources, build),
+            "test": (sources, build),
+            "unity_tune": (sources, build),
+            "build_report": (build, set()),
+            "header_cost": (build, set()),
+            "errors": (build, set()),
+            "compile_commands": (sources, build | {"compile_commands"}),
+            # clang-tidy --fix edits sources
+            "tidy": (sources | {"compile_commands"}, build | sources),
+            "clean": (set(), build),
+            "format": (sources, sources),
+            "format_diff": (sources, sources),
+            "staged_format_check": (sources, set()),
+        }
+
+    def run_pipeline(self, parser, steps_argv):
+        import copy
+        from cmake_cli import pipeline
+
+        steps = []
+        step_resources = []
+        for argv in steps_argv:
+            step = copy.copy(self)
+            step.args = parser.parse_args(argv)
+            steps.append(step.pick_and_use_sub_command)
+            step_resources.append(self.command_resources().get(
+                step.args.command))
+
+        start = time.time()
+        results = pipeline.run_steps(steps,
+                                     pipeline.dependencies(step_resources))
+        print(
+            pipeline.format_summary([" ".join(argv) for argv in steps_argv],
+                                    results,
+                                    time.time() - start))
+        for r in results:
+            if r["returncode"]:
+                sys.exit(r["returncode"])
+
+    # base_format_command(find_cmd, base_needed) became
+    # base_format_command(files)
+    def check_removed_hooks(self):
+        import inspect
+
+        overridden = [(name, replacement)
+                      for name, replacement in removed_hooks.items()
+                      if hasattr(self, name)]
+        if "find_cmd" in inspect.signature(
+                self.base_format_command).parameters:
+            overridden.append(("base_format_command(find_cmd, base_needed)",
+                               "base_format_command(files)"))
+        if overridden:
+            for name, replacement in overridden:
+                print("{} overrides {}, which is no longer used, override {} "
+                      "instead".format(type(self).__name__, name,
+                                       replacement))
+            sys.exit(1)
+
     def run_with_cli_args(self):
-        main_parser = self.build_parser()
+        from cmake_cli import pipeline
 
-        self.args = main_parser.parse_args()
+        self.check_removed_hooks()
+        main_parser = self.build_parser()
 
         try:
+            steps_argv = pipeline.split_steps(sys.argv[1:])
+            if len(steps_argv) > 1:
+                self.run_pipeline(main_parser, steps_argv)
+                return
+
+            self.args = main_parser.parse_args()
             self.pick_and_use_sub_command()
         except KeyboardInterrupt:
             sys.exit(1)
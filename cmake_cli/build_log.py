@@ -0,0 +1,121 @@
+import gzip
+import os
+import time
+
+from cmake_cli.cache import atomic_write_json, load_json
+
+# lines kept after a diagnostic: the source line, caret and notes
+max_context = 8
+
+
+def log_name(build_id):
+    return build_id + ".log.gz"
+
+
+def index_name(build_id):
+    return build_id + ".json"
+
+
+# ids sort in build order
+def builds(log_dir):
+    try:
+        names = os.listdir(log_dir)
+    except OSError:
+        return []
+    ids = set()
+    for name in names:
+        for suffix in [".json", ".log.gz"]:
+            if name.endswith(suffix):
+                ids.add(name[:-len(suffix)])
+    return sorted(ids)
+
+
+def read_index(log_dir, build_id):
+    return load_json(os.path.join(log_dir, index_name(build_id)))
+
+
+def read_log(log_dir, build_id):
+    with gzip.open(os.path.join(log_dir, log_name(build_id)),
+                   "rt",
+                   errors="replace") as f:
+        return f.read()
+
+
+# streams the output of one build into a compressed log next to an index
+# of its diagnostics, keeping the last keep builds of the directory
+class BuildLog():
+    def __init__(self, log_dir, directory, keep=10):
+        os.makedirs(log_dir, exist_ok=True)
+        self.log_dir = log_dir
+        self.directory = directory
+        self.keep = keep
+        self.start = time.time()
+        # microseconds keep ids in build order, the exclusive open keeps two
+        # builds from sharing one (pipelines run several in one process)
+        now = self.start
+        while True:
+            self.build_id = "{}-{:06d}-{}".format(
+                time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+                int(now * 1e6) % 1000000, os.getpid())
+            try:
+                self.file = gzip.open(os.path.join(log_dir,
+                                                   log_name(self.build_id)),
+                                      "xt",
+                                      compresslevel=6)
+                break
+            except FileExistsError:
+                now += 1e-6
+        self.lines = 0
+        self.diagnostics = []
+        self.context = None
+
+    def write(self, line):
+        self.file.write(line + "\n")
+        self.lines += 1
+
+    # called with the parsed diagnostic right after its line was written
+    def add_diagnostic(self, diagnostic):
+        diagnostic = dict(diagnostic)
+        diagnostic["file"] = os.path.normpath(
+            os.path.join(os.path.abspath(self.directory),
+                         diagnostic["file"]))
+        diagnostic["log_line"] = self.lines
+        diagnostic["context"] = []
+        self.diagnostics.append(diagnostic)
+        self.context = diagnostic["context"]
+
+    # lines after a diagnostic until the next build step or diagnostic
+    def add_context(self, line, ends_context):
+        if ends_context:
+            self.context = None
+        elif self.context is not None and len(self.context) < max_context:
+            self.context.append(line)
+
+    def close(self, returncode):
+        self.file.close()
+        files = {}
+        counts = {}
+        for i, d in enumerate(self.diagnostics):
+            files.setdefault(d["file"], []).append(i)
+            counts[d["severity"]] = counts.get(d["severity"], 0) + 1
+        atomic_write_json(
+            os.path.join(self.log_dir, index_name(self.build_id)), {
+                "build": self.build_id,
+                "directory": self.directory,
+                "returncode": returncode,
+                "start": self.start,
+                "duration": time.time() - self.start,
+                "lines": self.lines,
+                "counts": counts,
+                "diagnostics": self.diagnostics,
+                "files": files,
+            })
+        self.prune()
+
+    def prune(self):
+        for build_id in builds(self.log_dir)[:-self.keep]:
+            for name in [index_name(build_id), log_name(build_id)]:
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                except OSError:
+                    pass
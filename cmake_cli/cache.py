@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+
+# state shared by every project, unlike BaseCMakeBuilder.cache_dir()
+def user_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "cmake_cli")
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hash_bytes(f.read())
+
+
+def hash_json(data):
+    return hash_bytes(json.dumps(data, sort_keys=True).encode())
+
+
+def load_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# write to a temporary file in the same directory and rename it over the
+# destination so readers never see a partially written file
+def atomic_write(path, data):
+    import tempfile
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix="." + os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data):
+    atomic_write(path, json.dumps(data, indent=2, sort_keys=True))
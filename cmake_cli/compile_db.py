@@ -0,0 +1,129 @@
+import json
+import os
+import shlex
+from contextlib import suppress
+
+from cmake_cli.cache import (atomic_write, atomic_write_json, hash_bytes,
+                             hash_json, load_json)
+
+file_name = "compile_commands.json"
+
+
+def db_path(directory):
+    return os.path.join(directory, file_name)
+
+
+def entry_source(entry):
+    return os.path.normpath(
+        os.path.join(entry.get("directory", ""), entry["file"]))
+
+
+def entry_arguments(entry):
+    if "arguments" in entry:
+        return list(entry["arguments"])
+    return shlex.split(entry["command"])
+
+
+# Ninja Multi-Config lists each file once per build type, told apart by the
+# CMAKE_INTDIR definition
+def config_entries(entries, config):
+    define = '-DCMAKE_INTDIR="{}"'.format(config)
+    out = []
+    for entry in entries:
+        arguments = entry_arguments(entry)
+        if define in arguments or not any(
+                a.startswith("-DCMAKE_INTDIR=") for a in arguments):
+            out.append(entry)
+    return out
+
+
+# compile_commands-<config>.json next to the database, rewritten when the
+# database changes
+def write_config(path, config):
+    output = "{}-{}.json".format(os.path.splitext(path)[0], config)
+    with suppress(OSError):
+        if os.stat(output).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return output
+    with open(path) as f:
+        entries = json.load(f)
+    atomic_write(output, json.dumps(config_entries(entries, config),
+                                    indent=2))
+    return output
+
+
+# entries from earlier databases win when several compile the same file
+def merge(paths):
+    seen = set()
+    out = []
+    for path in paths:
+        with open(path) as f:
+            entries = json.load(f)
+        for entry in entries:
+            source = entry_source(entry)
+            if source not in seen:
+                seen.add(source)
+                out.append(entry)
+    return out
+
+
+def signature(paths):
+    out = []
+    for path in paths:
+        stat = os.stat(path)
+        out.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+    return hash_json(out)
+
+
+def read_bytes(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# the output may only be replaced if it is missing, a symlink or the file
+# last written by write_merged, never a file someone else put there
+def owned(output, state):
+    if os.path.islink(output) or not os.path.exists(output):
+        return True
+    existing = read_bytes(output)
+    return existing is not None and hash_bytes(existing) == state.get("hash")
+
+
+def write_merged(paths, output, state_path):
+    state = load_json(state_path, {})
+    if not owned(output, state):
+        print(output, "exists - not overriding")
+        return False
+
+    sig = signature(paths)
+    if (state.get("signature") == sig and os.path.isfile(output)
+            and not os.path.islink(output)):
+        print(output, "is up to date")
+        return True
+
+    contents = json.dumps(merge(paths), indent=2)
+    atomic_write(output, contents)
+    atomic_write_json(state_path, {
+        "signature": sig,
+        "hash": hash_bytes(contents.encode()),
+    })
+    print("wrote", output, "from", ", ".join(paths))
+    return True
+
+
+# replaces the output atomically so tools never see it missing
+def link(target, output, state_path):
+    if os.path.islink(output) and os.readlink(output) == target:
+        return True
+    if not owned(output, load_json(state_path, {})):
+        print(output, "exists - not overriding")
+        return False
+
+    tmp = output + ".cmake_cli_tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.replace(tmp, output)
+    return True
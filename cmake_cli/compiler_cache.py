@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+
+
+# a compiler launcher which caches compiles, subclass to add backends
+class CompilerCache():
+    name = None
+
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def executable(self):
+        return self.name
+
+    def available(self):
+        return shutil.which(self.executable()) is not None
+
+    # environment for the build (and the stats commands)
+    def env(self):
+        return {}
+
+    # {"hits": n, "misses": n, "uncacheable": n} or None if unknown
+    def stats(self):
+        return None
+
+    def run(self, args):
+        process = subprocess.run([self.executable()] + args,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL,
+                                 universal_newlines=True,
+                                 env=dict(os.environ, **self.env()))
+        if process.returncode != 0:
+            return None
+        return process.stdout
+
+
+class Ccache(CompilerCache):
+    name = "ccache"
+
+    hit_keys = ["direct_cache_hit", "preprocessed_cache_hit"]
+    miss_keys = ["cache_miss"]
+    uncacheable_keys = [
+        "autoconf_test", "bad_compiler_arguments", "called_for_link",
+        "called_for_preprocessing", "compile_failed",
+        "compiler_produced_empty_output", "compiler_produced_no_output",
+        "compiler_produced_stdout", "could_not_use_modules",
+        "could_not_use_precompiled_header", "multiple_source_files",
+        "no_input_file", "output_to_stdout", "preprocessor_error",
+        "unsupported_code_directive", "unsupported_compiler_option",
+        "unsupported_source_language"
+    ]
+
+    # ccache -s labels from before --print-stats existed
+    old_labels = {
+        "cache hit (direct)": "direct_cache_hit",
+        "cache hit (preprocessed)": "preprocessed_cache_hit",
+        "cache miss": "cache_miss",
+        "called for link": "called_for_link",
+        "called for preprocessing": "called_for_preprocessing",
+        "compile failed": "compile_failed",
+        "preprocessor error": "preprocessor_error",
+        "unsupported compiler option": "unsupported_compiler_option",
+        "unsupported source language": "unsupported_source_language",
+        "no input file": "no_input_file",
+        "multiple source files": "multiple_source_files",
+        "autoconf compile/link": "autoconf_test",
+    }
+
+    def env(self):
+        out = {}
+        if self.cache_dir is not None:
+            out["CCACHE_DIR"] = self.cache_dir
+        if self.max_size is not None:
+            out["CCACHE_MAXSIZE"] = self.max_size
+        return out
+
+    def raw_stats(self):
+        output = self.run(["--print-stats"])
+        out = {}
+        if output is not None:
+            for line in output.splitlines():
+                key, _, value = line.partition("\t")
+                if value.isdigit():
+                    out[key] = int(value)
+            return out
+
+        output = self.run(["-s"])
+        if output is None:
+            return None
+        for line in output.splitlines():
+            match = re.match(r"^(.*?)\s{2,}(\d+)\s*$", line)
+            if match is not None and match.group(1) in self.old_labels:
+                out[self.old_labels[match.group(1)]] = int(match.group(2))
+        return out
+
+    def stats(self):
+        raw = self.raw_stats()
+        if raw is None:
+            return None
+        return {
+            "hits": sum(raw.get(k, 0) for k in self.hit_keys),
+            "misses": sum(raw.get(k, 0) for k in self.miss_keys),
+            "uncacheable": sum(raw.get(k, 0) for k in self.uncacheable_keys),
+        }
+
+
+class Sccache(CompilerCache):
+    name = "sccache"
+
+    def env(self):
+        out = {}
+        if self.cache_dir is not None:
+            out["SCCACHE_DIR"] = self.cache_dir
+        if self.max_size is not None:
+            out["SCCACHE_CACHE_SIZE"] = self.max_size
+        return out
+
+    def stats(self):
+        output = self.run(["--show-stats", "--stats-format=json"])
+        if output is None:
+            return None
+        try:
+            raw = json.loads(output)["stats"]
+        except (ValueError, KeyError):
+            return None
+
+        def counts(name):
+            return sum(raw.get(name, {}).get("counts", {}).values())
+
+        return {
+            "hits": counts("cache_hits"),
+            "misses": counts("cache_misses"),
+            "uncacheable": (raw.get("requests_not_cacheable", 0) +
+                            raw.get("non_cacheable_compilations", 0)),
+        }
+
+
+# backends are tried in order for "auto"
+def select(choice, backends):
+    for backend in backends:
+        if choice in ("auto", backend.name) and backend.available():
+            return backend
+    return None
+
+
+def stats_delta(before, after):
+    if before is None or after is None:
+        return None
+    return {k: after[k] - before[k] for k in after}
+
+
+def format_stats(name, delta):
+    looked_up = delta["hits"] + delta["misses"]
+    rate = ""
+    if looked_up > 0:
+        rate = " ({:.1f}% hit rate)".format(100 * delta["hits"] / looked_up)
+    return "{}: {} hits, {} misses, {} uncacheable{}".format(
+        name, delta["hits"], delta["misses"], delta["uncacheable"], rate)
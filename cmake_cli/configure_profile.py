@@ -0,0 +1,151 @@
+import json
+import os
+
+from cmake_cli.ninja_log import format_ms
+
+probe_commands = {"try_compile", "try_run"}
+
+
+def trace_path(directory):
+    return os.path.join(directory, "cmake_cli_configure_trace.json")
+
+
+# CMake 3.18+, the trace loads in chrome://tracing or ui.perfetto.dev
+def profile_args(path):
+    return ["--profiling-format=google-trace", "--profiling-output=" + path]
+
+
+# every command CMake ran, with total and self time in ms. Besides the
+# name, arguments and location each call records whether an enclosing call
+# has the same name or is in the same file (so recursion and nesting aren't
+# counted twice in totals) and whether it is inside a check_* call.
+def read_calls(path):
+    with open(path) as f:
+        events = json.load(f)
+
+    calls = []
+    stack = []
+    for event in events:
+        if event.get("ph") == "B":
+            args = event.get("args", {})
+            location = args.get("location", "")
+            file, _, line = location.rpartition(":")
+            name = event.get("name", "").lower()
+            stack.append({
+                "name": name,
+                "args": args.get("functionArgs", ""),
+                "file": file,
+                "location": location,
+                "start": event["ts"],
+                "self": 0.0,
+                "outer_name": all(c["name"] != name for c in stack),
+                "outer_file": all(c["file"] != file for c in stack),
+                "in_check": any(c["name"].startswith("check_")
+                                for c in stack),
+            })
+        elif event.get("ph") == "E" and stack:
+            call = stack.pop()
+            call["end"] = event["ts"]
+            call["duration"] = (call["end"] - call["start"]) / 1000
+            call["self"] += call["duration"]
+            if stack:
+                stack[-1]["self"] -= call["duration"]
+            calls.append(call)
+    return calls
+
+
+def is_probe(call):
+    return call["name"].startswith("check_") or (
+        call["name"] in probe_commands and not call["in_check"])
+
+
+def summarize(calls, top=10):
+    if not calls:
+        return None
+
+    files = {}
+    functions = {}
+    for call in calls:
+        entry = files.setdefault(call["file"], {
+            "file": call["file"],
+            "total": 0.0,
+            "self": 0.0,
+            "calls": 0
+        })
+        entry["self"] += call["self"]
+        entry["calls"] += 1
+        if call["outer_file"]:
+            entry["total"] += call["duration"]
+
+        entry = functions.setdefault(call["name"], {
+            "name": call["name"],
+            "total": 0.0,
+            "self": 0.0,
+            "calls": 0
+        })
+        entry["self"] += call["self"]
+        entry["calls"] += 1
+        if call["outer_name"]:
+            entry["total"] += call["duration"]
+
+    def slowest(rows):
+        return sorted(rows, key=lambda r: r["total"], reverse=True)[:top]
+
+    def call_row(call, label):
+        return {
+            "call": label,
+            "location": call["location"],
+            "total": call["duration"]
+        }
+
+    return {
+        "total": (max(c["end"] for c in calls) -
+                  min(c["start"] for c in calls)) / 1000,
+        "commands": len(calls),
+        "files": slowest(files.values()),
+        "functions": slowest(functions.values()),
+        "find_package": slowest(
+            call_row(c, c["args"].split(" ")[0]) for c in calls
+            if c["name"] == "find_package"),
+        "probes": slowest(
+            call_row(c, "{}({})".format(c["name"], c["args"]))
+            for c in calls if is_probe(c)),
+    }
+
+
+def display_path(path):
+    relative = os.path.relpath(path)
+    return path if relative.startswith("..") else relative
+
+
+def format_summary(summary, width=60):
+    lines = [
+        "configure time: {} in {} commands".format(
+            format_ms(summary["total"]), summary["commands"])
+    ]
+
+    def shorten(text):
+        return text if len(text) <= width else text[:width - 3] + "..."
+
+    def table(title, rows, label, with_self):
+        if not rows:
+            return
+        lines.append("")
+        lines.append(title + ":")
+        for row in rows:
+            times = "{:>9}".format(format_ms(row["total"]))
+            if with_self:
+                times += "  {:>9}".format(format_ms(row["self"]))
+            lines.append("  {}  {}".format(times, label(row)))
+
+    table("slowest files (total, self)", summary["files"],
+          lambda r: display_path(r["file"]) or "<unknown>", True)
+    table("slowest commands (total, self)", summary["functions"],
+          lambda r: "{} ({} calls)".format(r["name"], r["calls"]), True)
+    table("slowest find_package calls", summary["find_package"],
+          lambda r: "{}  {}".format(r["call"], display_path(r["location"])),
+          False)
+    table("slowest checks and try_compile probes", summary["probes"],
+          lambda r: "{}  {}".format(shorten(r["call"]),
+                                    display_path(r["location"])), False)
+    return "\n".join(lines)
@@ -3,6 +3,19 @@ import sys
 import subprocess
 
 from cmake_cli.base_cmake_builder import BaseCMakeBuilder
+from cmake_cli.cache import atomic_write_json, load_json, user_cache_dir
+
+extension_dirs = [".", "./scripts"]
+extension_names = ["cmake_cli_extend", ".cmake_cli_extend"]
+
+# environment variable naming a builder as module:Class or as the name of an
+# entry point in the cmake_cli.builders group
+builder_env_var = "CMAKE_CLI_BUILDER"
+entry_point_group = "cmake_cli.builders"
+
+
+def extension_cache_path():
+    return os.path.join(user_cache_dir(), "extensions.json")
 
 
 def try_run(path):
@@ -14,11 +27,125 @@ def try_run(path):
             sys.exit(1)
 
 
+def dir_mtimes():
+    out = []
+    for directory in extension_dirs:
+        try:
+            out.append(os.stat(directory).st_mtime_ns)
+        except OSError:
+            out.append(None)
+    return out
+
+
+# python modules are loaded in process, executables are run as before
+def find_extension():
+    for directory in extension_dirs:
+        for name in extension_names:
+            path = os.path.join(directory, name + ".py")
+            if os.path.isfile(path):
+                return "module", path
+    for directory in extension_dirs:
+        for name in extension_names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return "executable", path
+    return None, None
+
+
+# adding or removing an extension changes the mtime of its directory, so the
+# previous resolution for this directory holds while the mtimes are unchanged
+def cached_find_extension():
+    cwd = os.getcwd()
+    mtimes = dir_mtimes()
+    cache = load_json(extension_cache_path(), {})
+    entry = cache.get(cwd)
+    if entry is not None and entry["mtimes"] == mtimes:
+        return entry["kind"], entry["path"]
+
+    kind, path = find_extension()
+    cache[cwd] = {"mtimes": mtimes, "kind": kind, "path": path}
+    try:
+        atomic_write_json(extension_cache_path(), cache)
+    except OSError:
+        pass
+    return kind, path
+
+
+def builder_from_module(module):
+    builder = getattr(module, "cmake_cli_builder", None)
+    if builder is not None:
+        return builder
+
+    candidates = [
+        v for v in vars(module).values()
+        if isinstance(v, type) and issubclass(v, BaseCMakeBuilder)
+        and v is not BaseCMakeBuilder and v.__module__ == module.__name__
+    ]
+    # prefer the most derived class if the module defines several
+    leaves = [
+        c for c in candidates
+        if not any(o is not c and issubclass(o, c) for o in candidates)
+    ]
+    if len(leaves) != 1:
+        print("{} must define exactly one BaseCMakeBuilder subclass or set "
+              "cmake_cli_builder, found: {}".format(
+                  module.__file__, ", ".join(c.__name__ for c in leaves)))
+        sys.exit(1)
+    return leaves[0]
+
+
+def load_module_from_path(path):
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("cmake_cli_extend", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_builder_from_spec(spec):
+    import importlib
+
+    if ":" in spec:
+        module_name, _, attr = spec.partition(":")
+        builder = importlib.import_module(module_name)
+        for part in attr.split("."):
+            builder = getattr(builder, part)
+        return builder
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        print("{}={} needs python 3.8 for entry points, use module:Class".
+              format(builder_env_var, spec))
+        sys.exit(1)
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=entry_point_group)
+    else:
+        eps = eps.get(entry_point_group, [])
+    for ep in eps:
+        if ep.name == spec:
+            return ep.load()
+    print("no {} entry point named {}".format(entry_point_group, spec))
+    sys.exit(1)
+
+
 def default_entry_point():
-    try_run("./cmake_cli_extend")
-    try_run("./.cmake_cli_extend")
-    try_run("./scripts/cmake_cli_extend")
-    try_run("./scripts/.cmake_cli_extend")
+    spec = os.environ.get(builder_env_var)
+    if spec:
+        load_builder_from_spec(spec)().run_with_cli_args()
+        return
+
+    kind, path = cached_find_extension()
+    if kind == "module":
+        builder_from_module(
+            load_module_from_path(path))().run_with_cli_args()
+        return
+    if kind == "executable":
+        try_run(path)
+
     BaseCMakeBuilder().run_with_cli_args()
 
 
@@ -0,0 +1,288 @@
+import os
+import re
+import shlex
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cmake_cli.cache import atomic_write_json, hash_json, load_json
+
+ignore_file_names = [".gitignore", ".ignore", ".fdignore"]
+
+index_version = 1
+
+
+def translate_glob(pattern):
+    out = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out += "/.*"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out += ".*"
+            i += 2
+            continue
+        if c == "*":
+            out += "[^/]*"
+        elif c == "?":
+            out += "[^/]"
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out += re.escape(pattern[i])
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out += re.escape(c)
+            else:
+                contents = pattern[i + 1:end]
+                if contents.startswith("!"):
+                    contents = "^" + contents[1:]
+                out += "[" + contents.replace("\\", "\\\\") + "]"
+                i = end
+        else:
+            out += re.escape(c)
+        i += 1
+    return out
+
+
+# returns (regex, negated, dir_only) or None for blank lines and comments
+def compile_ignore_line(line):
+    line = line.rstrip("\n")
+    if not line.endswith("\\ "):
+        line = line.rstrip(" ")
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # patterns without an inner slash match at any depth
+    if "/" in line:
+        regex = translate_glob(line.lstrip("/"))
+    else:
+        regex = "(?:.*/)?" + translate_glob(line)
+
+    return re.compile(regex + "$"), negated, dir_only
+
+
+# rules are (base directory with a trailing slash, regex, negated, dir_only)
+def parse_ignore_lines(base, lines):
+    rules = []
+    for line in lines:
+        compiled = compile_ignore_line(line)
+        if compiled is not None:
+            rules.append((base,) + compiled)
+    return rules
+
+
+def is_ignored(rules, path, is_dir):
+    ignored = False
+    for base, regex, negated, dir_only in rules:
+        if not path.startswith(base):
+            continue
+        if dir_only and not is_dir:
+            continue
+        if regex.match(path[len(base):]):
+            ignored = not negated
+    return ignored
+
+
+def read_lines(path):
+    try:
+        with open(path, errors="replace") as f:
+            return f.readlines()
+    except OSError:
+        return None
+
+
+def find_git_root(directory):
+    while True:
+        if os.path.exists(os.path.join(directory, ".git")):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+# ignore rules from .gitignore files in directories above the root of the
+# walk (up to the enclosing git repository) and from .git/info/exclude
+def root_ignore_lines(root):
+    git_root = find_git_root(root)
+    if git_root is None:
+        return []
+
+    out = []
+    exclude = read_lines(os.path.join(git_root, ".git", "info", "exclude"))
+    if exclude is not None:
+        out.append((git_root, exclude))
+
+    ancestors = []
+    directory = os.path.dirname(root)
+    while len(directory) >= len(git_root):
+        ancestors.append(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    for directory in reversed(ancestors):
+        for name in ignore_file_names:
+            lines = read_lines(os.path.join(directory, name))
+            if lines is not None:
+                out.append((directory, lines))
+
+    return out
+
+
+def stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# walks root in parallel with os.scandir, skipping hidden and ignored
+# entries like fd does. Directories whose mtime and applicable ignore files
+# are unchanged since the last walk are served from the index without
+# listing them again.
+# names are file names matched in addition to the extensions. With
+# with_dirs, returns the walked directories too.
+def find_files(extensions,
+               root=".",
+               index_path=None,
+               jobs=None,
+               names=None,
+               with_dirs=False):
+    root_abs = os.path.abspath(root)
+    extensions = set("." + ext for ext in extensions)
+    names = set() if names is None else set(names)
+
+    header = {"version": index_version, "root": root_abs,
+              "extensions": sorted(extensions), "names": sorted(names)}
+    index = None
+    if index_path is not None:
+        index = load_json(index_path)
+    if index is None or index.get("header") != header:
+        index = {"header": header, "dirs": {}}
+    old_dirs = index["dirs"]
+    new_dirs = {}
+
+    base_lines = root_ignore_lines(root_abs)
+    base_rules = []
+    for directory, lines in base_lines:
+        base_rules += parse_ignore_lines(directory + "/", lines)
+    base_signature = hash_json(base_lines)
+
+    def scan(rel_dir, parent_rules, parent_signature):
+        abs_dir = root_abs if rel_dir == "" else os.path.join(
+            root_abs, rel_dir)
+        ignore_mtimes = [
+            stat_mtime(os.path.join(abs_dir, name))
+            for name in ignore_file_names
+        ]
+        signature = hash_json([parent_signature, ignore_mtimes])
+        mtime = stat_mtime(abs_dir)
+
+        entry = old_dirs.get(rel_dir)
+        if (entry is None or entry["mtime"] != mtime
+                or entry["signature"] != signature):
+            ignore_lines = []
+            for name, ignore_mtime in zip(ignore_file_names, ignore_mtimes):
+                if ignore_mtime is not None:
+                    ignore_lines += read_lines(os.path.join(abs_dir,
+                                                            name)) or []
+            entry = {
+                "mtime": mtime,
+                "signature": signature,
+                "ignore_lines": ignore_lines,
+                "files": None,
+                "dirs": None,
+            }
+
+        rules = parent_rules + parse_ignore_lines(abs_dir + "/",
+                                                  entry["ignore_lines"])
+
+        if entry["files"] is None:
+            files = []
+            dirs = []
+            try:
+                with os.scandir(abs_dir) as it:
+                    for dir_entry in it:
+                        name = dir_entry.name
+                        if name.startswith("."):
+                            continue
+                        is_dir = dir_entry.is_dir(follow_symlinks=False)
+                        if not (is_dir or name in names or
+                                os.path.splitext(name)[1] in extensions):
+                            continue
+                        if is_ignored(rules, os.path.join(abs_dir, name),
+                                      is_dir):
+                            continue
+                        if is_dir:
+                            dirs.append(name)
+                        else:
+                            files.append(name)
+            except OSError:
+                pass
+            entry["files"] = sorted(files)
+            entry["dirs"] = sorted(dirs)
+
+        return rel_dir, entry, rules, signature
+
+    if jobs is None:
+        jobs = min(32, (os.cpu_count() or 1) * 4)
+
+    files = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(scan, "", base_rules, base_signature)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir, entry, rules, signature = future.result()
+                new_dirs[rel_dir] = entry
+                files += [os.path.join(rel_dir, f) for f in entry["files"]]
+                for d in entry["dirs"]:
+                    pending.add(
+                        executor.submit(scan, os.path.join(rel_dir, d), rules,
+                                        signature))
+
+    if index_path is not None:
+        index["dirs"] = new_dirs
+        atomic_write_json(index_path, index)
+
+    if with_dirs:
+        return sorted(files), sorted(new_dirs)
+    return sorted(files)
+
+
+def git_diff_names(diff_args, diff_filter, pathspecs):
+    cmd = (["git", "diff"] + shlex.split(diff_args) + [
+        "--name-only", "--diff-filter=" + diff_filter, "--relative", "--"
+    ] + pathspecs)
+    # like the old git diff | fd pipeline, a git error just means no files
+    output = subprocess.run(cmd,
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return [os.path.normpath(f) for f in output.split("\n") if f]
+
+
+def git_diff_files(diff_args, extensions, candidates):
+    changed = set(
+        git_diff_names(diff_args, "ACMR", ["*." + ext for ext in extensions]))
+
+    # only keep files which aren't ignored
+    return [f for f in candidates if f in changed]
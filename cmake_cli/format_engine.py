@@ -0,0 +1,139 @@
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cmake_cli.cache import (atomic_write_json, hash_bytes, hash_file,
+                             hash_json, load_json)
+
+config_file_names = [".clang-format", "_clang-format"]
+
+# flags which only decide what clang-format does with its result, they don't
+# change what "formatted" means
+mode_flags = ["-i", "-n", "--dry-run", "--Werror"]
+
+
+def clang_format_version(clang_format):
+    return subprocess.run([clang_format, "--version"],
+                          stdout=subprocess.PIPE,
+                          check=True,
+                          universal_newlines=True).stdout.strip()
+
+
+# hash of the nearest config file, which is the one clang-format uses
+def config_hash(directory, memo):
+    if directory in memo:
+        return memo[directory]
+
+    out = None
+    for name in config_file_names:
+        config = os.path.join(directory, name)
+        if os.path.isfile(config):
+            out = hash_file(config)
+            break
+    if out is None:
+        parent = os.path.dirname(directory)
+        if parent != directory:
+            out = config_hash(parent, memo)
+
+    memo[directory] = out
+    return out
+
+
+def batches(files, jobs, max_batch_size):
+    batch_size = max(1, min(max_batch_size, -(-len(files) // jobs)))
+    return [
+        files[i:i + batch_size] for i in range(0, len(files), batch_size)
+    ]
+
+
+def format_files(files,
+                 clang_format_args,
+                 cache_path=None,
+                 jobs=None,
+                 max_batch_size=32,
+                 clang_format="clang-format"):
+    args = shlex.split(clang_format_args)
+    in_place = "-i" in args
+    checking = ("--dry-run" in args or "-n" in args) and "--Werror" in args
+
+    # only in place formatting and passing checks tell us a file is formatted
+    use_cache = cache_path is not None and (in_place or checking)
+
+    if use_cache:
+        version = clang_format_version(clang_format)
+        cache = load_json(cache_path, {})
+        if cache.get("version") != version:
+            cache = {"version": version, "files": {}}
+        key_base = [version, [a for a in args if a not in mode_flags]]
+        config_hashes = {}
+
+        def key(path):
+            with open(path, "rb") as f:
+                content = f.read()
+            directory = os.path.dirname(os.path.abspath(path))
+            return hash_json(
+                key_base +
+                [config_hash(directory, config_hashes),
+                 hash_bytes(content)])
+
+        keys = {}
+        to_format = []
+        for path in files:
+            try:
+                keys[path] = key(path)
+            except OSError as e:
+                # clang-format reports it and fails
+                print("WARN: can't read {} ({})".format(path, e.strerror))
+                to_format.append(path)
+                continue
+            if cache["files"].get(path) != keys[path]:
+                to_format.append(path)
+    else:
+        to_format = list(files)
+
+    print("running clang-format on {} files ({} already formatted)".format(
+        len(to_format),
+        len(files) - len(to_format)))
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    def run_batch(batch):
+        process = subprocess.run([clang_format] + args + batch,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        return batch, process
+
+    returncode = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(run_batch, batch)
+            for batch in batches(to_format, jobs, max_batch_size)
+        ]
+        for future in as_completed(futures):
+            batch, process = future.result()
+            sys.stdout.buffer.write(process.stdout)
+            sys.stdout.flush()
+            sys.stderr.buffer.write(process.stderr)
+            sys.stderr.flush()
+
+            # same exit status xargs would give
+            if process.returncode == 255:
+                returncode = 124
+            elif process.returncode != 0 and returncode == 0:
+                returncode = 123
+
+            if use_cache and process.returncode == 0:
+                for path in batch:
+                    try:
+                        cache["files"][path] = (key(path)
+                                                if in_place else keys[path])
+                    except (OSError, KeyError):
+                        pass
+
+    if use_cache:
+        atomic_write_json(cache_path, cache)
+
+    return returncode
@@ -0,0 +1,162 @@
+import os
+
+from cmake_cli import ninja_deps, ninja_log
+from cmake_cli.cache import atomic_write_json, load_json
+
+source_extensions = {
+    ".c", ".C", ".cc", ".cpp", ".cxx", ".c++", ".cu", ".m", ".mm"
+}
+
+# bump when the layout of the index changes
+index_version = 1
+
+
+# one index per manifest, multi-config directories have one per build type
+def index_path(directory, ninja_file=None):
+    name = "cmake_cli_header_cost"
+    if ninja_file is not None:
+        name += "-" + os.path.splitext(ninja_file)[0]
+    return os.path.join(directory, name + ".json")
+
+
+def file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_header(path):
+    return os.path.splitext(path)[1] not in source_extensions
+
+
+# adds the compile times in the part of .ninja_log after offset, the last
+# time recorded for an output wins. Ninja only appends to the log between
+# recompactions, which rewrite it: the line before offset is kept and a
+# mismatch means the log has to be read from the start.
+def update_durations(path, index):
+    with open(path, "rb") as f:
+        tail = index["log_tail"].encode()
+        if index["log_offset"] >= len(tail) > 0:
+            f.seek(index["log_offset"] - len(tail))
+            if f.read(len(tail)) != tail:
+                index["log_offset"] = 0
+                index["durations"] = {}
+        else:
+            index["log_offset"] = 0
+            index["durations"] = {}
+        f.seek(index["log_offset"])
+        data = f.read()
+
+    # a line still being written is left for the next update
+    end = data.rfind(b"\n") + 1
+    last_line = ""
+    for line in data[:end].decode(errors="replace").splitlines():
+        last_line = line
+        if line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) < 5:
+            continue
+        if os.path.splitext(fields[3])[1] in ninja_log.compile_extensions:
+            index["durations"][fields[3]] = int(fields[1]) - int(fields[0])
+    if end > 0:
+        index["log_offset"] += end
+        index["log_tail"] = last_line + "\n"
+
+
+# {header: {"fan_out": objects including it, "cost": their total compile
+# time in ms}} from the deps of each object
+def rank(deps, durations):
+    out = {}
+    for output, (_, inputs) in deps.items():
+        duration = durations.get(output, 0)
+        for dep in inputs:
+            if is_header(dep):
+                entry = out.setdefault(dep, {"fan_out": 0, "cost": 0})
+                entry["fan_out"] += 1
+                entry["cost"] += duration
+    return out
+
+
+def empty_index():
+    return {
+        "version": index_version,
+        "deps_stat": None,
+        "log_stat": None,
+        "log_offset": 0,
+        "log_tail": "",
+        "durations": {},
+        "deps": {},
+        "headers": {},
+    }
+
+
+# the index in the build directory, brought up to date with .ninja_log and
+# .ninja_deps. Nothing is read when neither changed, only the new part of
+# .ninja_log when it grew and the deps (which ninja only dumps whole) when
+# .ninja_deps changed.
+def load_index(directory, ninja_file=None):
+    path = index_path(directory, ninja_file)
+    index = load_json(path)
+    if index is None or index.get("version") != index_version:
+        index = empty_index()
+
+    log_stat = file_stat(ninja_log.log_path(directory))
+    deps_stat = file_stat(os.path.join(directory, ".ninja_deps"))
+    if log_stat == index["log_stat"] and deps_stat == index["deps_stat"]:
+        return index
+
+    if log_stat is None:
+        index["durations"] = {}
+    elif log_stat != index["log_stat"]:
+        update_durations(ninja_log.log_path(directory), index)
+    if deps_stat is None:
+        index["deps"] = {}
+    elif deps_stat != index["deps_stat"]:
+        index["deps"] = ninja_deps.read_deps(directory, ninja_file)
+    index["log_stat"] = log_stat
+    index["deps_stat"] = deps_stat
+    index["headers"] = rank(index["deps"], index["durations"])
+    atomic_write_json(path, index)
+    return index
+
+
+# headers under the directory under, or all with None
+def report(index, top=20, under=None):
+    prefix = None if under is None else os.path.join(under, "")
+    headers = [
+        dict(header=header, **entry)
+        for header, entry in index["headers"].items()
+        if prefix is None or header.startswith(prefix)
+    ]
+    headers.sort(key=lambda h: (h["cost"], h["fan_out"]), reverse=True)
+    durations = index["durations"]
+    return {
+        "objects": len(index["deps"]),
+        "untimed_objects": sum(1 for output in index["deps"]
+                               if output not in durations),
+        "compile": sum(durations.get(output, 0)
+                       for output in index["deps"]),
+        "headers": headers[:top],
+    }
+
+
+def format_report(result):
+    lines = [
+        "{} objects, {} of compiles".format(
+            result["objects"], ninja_log.format_ms(result["compile"]))
+    ]
+    if result["untimed_objects"]:
+        lines.append("{} objects have no recorded compile time".format(
+            result["untimed_objects"]))
+    if not result["headers"]:
+        lines.append("no headers found")
+        return "\n".join(lines)
+    lines.append("")
+    lines.append("  {:>9}  {:>7}  {}".format("rebuild", "fan-out", "header"))
+    for h in result["headers"]:
+        lines.append("  {:>9}  {:>7}  {}".format(
+            ninja_log.format_ms(h["cost"]), h["fan_out"], h["header"]))
+    return "\n".join(lines)
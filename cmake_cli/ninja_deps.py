@@ -0,0 +1,159 @@
+import json
+import os
+import subprocess
+
+
+# ninja_file picks a manifest other than build.ninja, like the
+# build-<Config>.ninja of each build type with Ninja Multi-Config
+def run_tool(directory, args, check=True, ninja_file=None):
+    cmd = ["ninja", "-C", directory]
+    if ninja_file is not None:
+        cmd += ["-f", ninja_file]
+    process = subprocess.run(cmd + ["-t"] + args,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode,
+                                            process.args, process.stdout,
+                                            process.stderr)
+    return process
+
+
+def normalize(directory, path):
+    return os.path.normpath(os.path.join(os.path.abspath(directory), path))
+
+
+# returns {output: (deps mtime, [absolute dependency paths])} from the deps
+# ninja recorded (headers included by each object)
+def read_deps(directory, ninja_file=None):
+    out = {}
+    current = None
+    for line in run_tool(directory, ["deps"],
+                         ninja_file=ninja_file).stdout.splitlines():
+        if not line.strip():
+            current = None
+        elif not line.startswith(" "):
+            name, _, info = line.partition(": #deps")
+            mtime = None
+            if "deps mtime " in info:
+                mtime = info.split("deps mtime ")[1].split()[0]
+            current = []
+            out[name] = (mtime, current)
+        elif current is not None:
+            current.append(normalize(directory, line.strip()))
+    return out
+
+
+def reverse_deps(deps):
+    out = {}
+    for output, (_, inputs) in deps.items():
+        for dep in inputs:
+            out.setdefault(dep, set()).add(output)
+    return out
+
+
+# returns {target: {"inputs": [...], "outputs": [...]}} for the targets
+# ninja knows, unknown targets are skipped
+def query(directory, targets, ninja_file=None):
+    out = {}
+    if not targets:
+        return out
+    process = run_tool(directory, ["query"] + list(targets),
+                       check=False,
+                       ninja_file=ninja_file)
+    if process.returncode != 0:
+        # ninja stops at the first unknown target, so query one at a time
+        if len(targets) == 1:
+            return out
+        for target in targets:
+            out.update(query(directory, [target], ninja_file))
+        return out
+
+    current = None
+    section = None
+    for line in process.stdout.splitlines():
+        if not line.startswith(" "):
+            current = {"inputs": [], "outputs": []}
+            out[line.rstrip(":")] = current
+        elif line.startswith("  input:"):
+            section = "inputs"
+        elif line.startswith("  outputs:"):
+            section = "outputs"
+        elif current is not None and section is not None:
+            entry = line.strip()
+            for prefix in ["|| ", "| "]:
+                if entry.startswith(prefix):
+                    entry = entry[len(prefix):]
+            current[section].append(entry)
+    return out
+
+
+def rules(directory, ninja_file=None):
+    out = {}
+    for line in run_tool(directory, ["targets", "all"],
+                         ninja_file=ninja_file).stdout.splitlines():
+        target, _, rule = line.rpartition(": ")
+        out[target] = rule
+    return out
+
+
+# outputs from the compile database, from CMake 3.20
+def compile_db_outputs(directory):
+    try:
+        with open(os.path.join(directory, "compile_commands.json")) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    out = {}
+    for entry in entries:
+        if "output" in entry:
+            source = os.path.normpath(
+                os.path.join(entry["directory"], entry["file"]))
+            out.setdefault(source, set()).add(entry["output"])
+    return out
+
+
+# the smallest set of non-phony targets which rebuilds everything depending
+# on the changed files: objects including them and what links them
+def affected_targets(directory, changed, ninja_file=None):
+    changed = [os.path.abspath(p) for p in changed]
+    by_dep = reverse_deps(read_deps(directory, ninja_file))
+    db_outputs = compile_db_outputs(directory)
+
+    objects = set()
+    unknown = []
+    for path in changed:
+        if path in by_dep:
+            objects |= by_dep[path]
+        elif path in db_outputs:
+            objects |= db_outputs[path]
+        else:
+            unknown.append(path)
+    # sources which haven't been compiled yet
+    for path in unknown:
+        for name in [path, os.path.relpath(path, directory)]:
+            result = query(directory, [name], ninja_file)
+            if result:
+                objects.update(*(v["outputs"] for v in result.values()))
+                break
+
+    target_rules = rules(directory, ninja_file)
+
+    def real(target):
+        return target_rules.get(target, "phony") != "phony"
+
+    affected = set(t for t in objects if real(t))
+    downstream = {}
+    frontier = list(affected)
+    while frontier:
+        result = query(directory, frontier, ninja_file)
+        frontier = []
+        for target, info in result.items():
+            consumers = set(o for o in info["outputs"] if real(o))
+            downstream[target] = consumers
+            for consumer in consumers - affected:
+                affected.add(consumer)
+                frontier.append(consumer)
+
+    return sorted(t for t in affected if not downstream.get(t))
@@ -0,0 +1,387 @@
+import os
+import subprocess
+import time
+
+from cmake_cli import ninja_deps
+from cmake_cli.cache import atomic_write_json, hash_json, load_json
+
+compile_extensions = {".o", ".obj", ".gch", ".pch", ".pcm"}
+# executables and shared or module libraries, archives (.a, static .lib)
+# are made by ar or lib and don't depend on the linker
+link_extensions = {"", ".so", ".dylib", ".dll", ".exe"}
+# the rules CMake's Ninja generators link executables and shared or module
+# libraries with, <LANG>_<KIND>_LINKER__<target>[_<config>]
+link_rule_kinds = [
+    "_EXECUTABLE_LINKER__", "_SHARED_LIBRARY_LINKER__",
+    "_MODULE_LIBRARY_LINKER__"
+]
+
+
+def log_path(directory):
+    return os.path.join(directory, ".ninja_log")
+
+
+# where the lines of the next build will start: the size of the log up to
+# its last complete line and that line, which tells later whether ninja
+# rewrote the log in between (it recompacts it at the start of a build).
+# None when the last line doesn't fit in what is read.
+def log_position(directory, chunk=65536):
+    try:
+        with open(log_path(directory), "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - chunk))
+            data = f.read()
+    except OSError:
+        # ninja hasn't written the log yet, all of it will be new
+        return {"offset": 0, "tail": ""}
+    end = data.rfind(b"\n") + 1
+    start = data.rfind(b"\n", 0, max(0, end - 1)) + 1
+    if start == 0 and size > len(data):
+        return None
+    return {
+        "offset": size - len(data) + end,
+        "tail": data[start:end].decode(errors="replace")
+    }
+
+
+# the lines after position when the log still starts with what it held
+# then, None when it was rewritten
+def appended_lines(path, position):
+    tail = position["tail"].encode(errors="replace")
+    with open(path, "rb") as f:
+        if position["offset"] < len(tail):
+            return None
+        f.seek(position["offset"] - len(tail))
+        if f.read(len(tail)) != tail:
+            return None
+        data = f.read()
+    return data.decode(errors="replace").splitlines(keepends=True)
+
+
+# returns a list of builds, each a list of edges sorted by end time. With
+# the position of the log before a build only the lines appended by it are
+# read, as one build. Otherwise, or when the log was rewritten since,
+# builds are told apart by their times: ninja appends to the log in
+# completion order and times restart at zero for each build, so a
+# decreasing end time marks the start of a new build. That misses builds
+# starting later than the last one ended, for example a short build after
+# a long one.
+def parse_ninja_log(path, position=None):
+    lines = None
+    if position is not None:
+        lines = appended_lines(path, position)
+    if lines is None:
+        with open(path, errors="replace") as f:
+            lines = f.readlines()
+        position = None
+
+    builds = []
+    edges = {}
+    last_end = None
+    for line in lines:
+        if line.startswith("#") or not line.endswith("\n"):
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 5:
+            continue
+        start, end = int(fields[0]), int(fields[1])
+        if last_end is None or (position is None and end < last_end):
+            edges = {}
+            builds.append(edges)
+        last_end = end
+
+        # edges with several outputs have one line per output
+        key = (start, end, fields[4])
+        if key not in edges:
+            edges[key] = {"start": start, "end": end, "outputs": []}
+        edges[key]["outputs"].append(fields[3])
+
+    return [
+        sorted(build.values(), key=lambda e: (e["end"], e["start"]))
+        for build in builds
+    ]
+
+
+# {output: rule} of the manifest, None when ninja can't tell
+def output_rules(directory, ninja_file=None):
+    try:
+        return ninja_deps.rules(directory, ninja_file)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# by rule when the output is in rules, else by name. Stamps of custom
+# commands and targets are under CMakeFiles and have no extension either.
+def is_link_output(output, rules=None):
+    if rules is not None and output in rules:
+        return any(kind in rules[output] for kind in link_rule_kinds)
+    ext = os.path.splitext(output)[1]
+    if "CMakeFiles" in output.replace("\\", "/").split("/"):
+        return False
+    return ((ext in link_extensions
+             and os.path.basename(output) != "build.ninja")
+            or ".so." in output)
+
+
+# a DLL's link also writes its import library, which may be listed first
+def edge_kind(edge, rules=None):
+    if os.path.splitext(edge["outputs"][0])[1] in compile_extensions:
+        return "compile"
+    if any(is_link_output(o, rules) for o in edge["outputs"]):
+        return "link"
+    return "other"
+
+
+def edge_name(edge):
+    return edge["outputs"][0]
+
+
+def edge_duration(edge):
+    return edge["end"] - edge["start"]
+
+
+# without the dependency graph this walks back from the last edge to finish,
+# each time to the edge which finished last before the current one started
+def estimate_critical_path(edges):
+    if not edges:
+        return []
+    current = max(edges, key=lambda e: e["end"])
+    path = [current]
+    while True:
+        before = [e for e in edges if e["end"] <= current["start"]]
+        if not before:
+            break
+        current = max(before, key=lambda e: e["end"])
+        path.append(current)
+    return list(reversed(path))
+
+
+# the report of the build after position, or of the last one told apart
+# by times without it
+def build_report(directory, jobs, top=10, ninja_file=None, position=None):
+    builds = parse_ninja_log(log_path(directory), position)
+    if not builds:
+        return None
+    edges = builds[-1]
+    rules = output_rules(directory, ninja_file)
+    kinds = [edge_kind(e, rules) for e in edges]
+
+    wall = max(e["end"] for e in edges) - min(e["start"] for e in edges)
+    total = sum(edge_duration(e) for e in edges)
+
+    def slowest(kind):
+        of_kind = [e for e, k in zip(edges, kinds) if k == kind]
+        of_kind.sort(key=edge_duration, reverse=True)
+        return [{
+            "output": edge_name(e),
+            "duration": edge_duration(e)
+        } for e in of_kind[:top]]
+
+    critical_path = estimate_critical_path(edges)
+    parallelism = total / wall if wall > 0 else 1.0
+
+    return {
+        "signature": hash_json([[e["start"], e["end"], e["outputs"]]
+                                for e in edges]),
+        "edges": len(edges),
+        "wall": wall,
+        "total": total,
+        "jobs": jobs,
+        "parallelism": parallelism,
+        "utilization": parallelism / jobs,
+        "compile": sum(edge_duration(e)
+                       for e, k in zip(edges, kinds) if k == "compile"),
+        "link": sum(edge_duration(e)
+                    for e, k in zip(edges, kinds) if k == "link"),
+        "slowest_compiles": slowest("compile"),
+        "slowest_links": slowest("link"),
+        "critical_path": [{
+            "output": edge_name(e),
+            "duration": edge_duration(e)
+        } for e in critical_path],
+        "critical_path_time": sum(edge_duration(e) for e in critical_path),
+        "durations": {edge_name(e): edge_duration(e)
+                      for e in edges},
+    }
+
+
+def history_path(directory):
+    return os.path.join(directory, "cmake_cli_build_report.json")
+
+
+# keeps the reports of the last two distinct builds and adds deltas
+# against the previous one
+def report_with_deltas(directory,
+                       jobs,
+                       top=10,
+                       ninja_file=None,
+                       position=None):
+    report = build_report(directory,
+                          jobs,
+                          top=top,
+                          ninja_file=ninja_file,
+                          position=position)
+    if report is None:
+        return None
+
+    history = load_json(history_path(directory), {})
+    current = history.get("current")
+    if current is not None and current["signature"] == report["signature"]:
+        previous = history.get("previous")
+    else:
+        previous = current
+        atomic_write_json(history_path(directory), {
+            "previous": previous,
+            "current": report
+        })
+
+    if previous is not None:
+        changes = []
+        for output, duration in report["durations"].items():
+            if output in previous["durations"]:
+                changes.append({
+                    "output": output,
+                    "delta": duration - previous["durations"][output]
+                })
+        changes.sort(key=lambda c: c["delta"], reverse=True)
+        report["deltas"] = {
+            "wall": report["wall"] - previous["wall"],
+            "total": report["total"] - previous["total"],
+            "compile": report["compile"] - previous["compile"],
+            "link": report["link"] - previous["link"],
+            "regressions": [c for c in changes[:top] if c["delta"] > 0],
+        }
+
+    return report
+
+
+def link_times_path(directory):
+    return os.path.join(directory, "cmake_cli_link_times.json")
+
+
+# appends the link steps of the build after position (the last one told
+# apart by times without it), tagged with the linker, to the history kept in
+# the build directory. Returns the history, or None if the build didn't link
+# anything new (no-op builds leave the log alone).
+def record_link_times(directory,
+                      linker,
+                      keep=50,
+                      ninja_file=None,
+                      position=None):
+    if not os.path.exists(log_path(directory)):
+        return None
+    builds = parse_ninja_log(log_path(directory), position)
+    if not builds:
+        return None
+    rules = output_rules(directory, ninja_file)
+    links = [e for e in builds[-1] if edge_kind(e, rules) == "link"]
+    if not links:
+        return None
+
+    signature = hash_json([[e["start"], e["end"], e["outputs"]]
+                           for e in links])
+    history = load_json(link_times_path(directory), [])
+    if history and history[-1]["signature"] == signature:
+        return None
+    history.append({
+        "signature": signature,
+        "linker": linker,
+        "time": time.time(),
+        "links": {edge_name(e): edge_duration(e)
+                  for e in links},
+    })
+    history = history[-keep:]
+    atomic_write_json(link_times_path(directory), history)
+    return history
+
+
+# mean time of each linker over the outputs linked by the last build, so
+# linkers are compared on the same link steps
+def compare_linkers(history):
+    outputs = history[-1]["links"]
+    by_linker = {}
+    for record in history:
+        durations = by_linker.setdefault(record["linker"], {})
+        for output, duration in record["links"].items():
+            if output in outputs:
+                durations.setdefault(output, []).append(duration)
+
+    out = {}
+    for linker, durations in by_linker.items():
+        means = [sum(d) / len(d) for d in durations.values()]
+        if means:
+            out[linker] = {
+                "links": len(means),
+                "mean": sum(means) / len(means),
+            }
+    return out
+
+
+def format_link_times(history):
+    record = history[-1]
+    durations = record["links"]
+    slowest = max(durations, key=durations.get)
+    lines = [
+        "linked {} outputs in {} with {} (slowest {} {})".format(
+            len(durations), format_ms(sum(durations.values())),
+            record["linker"], slowest, format_ms(durations[slowest]))
+    ]
+    comparison = compare_linkers(history)
+    if len(comparison) > 1:
+        for linker, stats in sorted(comparison.items(),
+                                    key=lambda i: i[1]["mean"]):
+            lines.append("  {:>9} per link with {} ({} outputs)".format(
+                format_ms(stats["mean"]), linker, stats["links"]))
+    return "\n".join(lines)
+
+
+def format_ms(ms):
+    return "{:.2f}s".format(ms / 1000)
+
+
+def format_delta(ms):
+    return "{}{:.2f}s".format("+" if ms >= 0 else "-", abs(ms) / 1000)
+
+
+def format_report(report):
+    deltas = report.get("deltas")
+
+    def with_delta(name):
+        out = format_ms(report[name])
+        if deltas is not None:
+            out += " ({})".format(format_delta(deltas[name]))
+        return out
+
+    lines = [
+        "edges run:      {}".format(report["edges"]),
+        "wall time:      {}".format(with_delta("wall")),
+        "total time:     {}".format(with_delta("total")),
+        "compile time:   {}".format(with_delta("compile")),
+        "link time:      {}".format(with_delta("link")),
+        "parallelism:    {:.1f} of {} jobs ({:.0f}% utilization)".format(
+            report["parallelism"], report["jobs"],
+            100 * report["utilization"]),
+    ]
+
+    def table(title, rows, value, formatter):
+        if not rows:
+            return
+        lines.append("")
+        lines.append(title + ":")
+        for row in rows:
+            lines.append("  {:>9}  {}".format(formatter(row[value]),
+                                              row["output"]))
+
+    table("slowest translation units", report["slowest_compiles"],
+          "duration", format_ms)
+    table("slowest link steps", report["slowest_links"], "duration",
+          format_ms)
+    table(
+        "estimated critical path ({})".format(
+            format_ms(report["critical_path_time"])),
+        report["critical_path"], "duration", format_ms)
+    if deltas is not None:
+        table("regressions since previous build", deltas["regressions"],
+              "delta", format_delta)
+
+    return "\n".join(lines)
@@ -0,0 +1,122 @@
+import re
+
+# NINJA_STATUS defaults to "[%f/%t] "
+progress_re = re.compile(r"^\[\d+/\d+\] ")
+ansi_re = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+diagnostic_re = re.compile(
+    r"^(?P<file>[^:\s][^:]*):(?P<line>\d+):(?:(?P<column>\d+):)? "
+    r"(?P<severity>fatal error|error|warning): (?P<message>.*)$")
+
+
+def parse_diagnostic(line):
+    match = diagnostic_re.match(ansi_re.sub("", line))
+    if match is None:
+        return None
+    out = match.groupdict()
+    out["line"] = int(out["line"])
+    if out["column"] is not None:
+        out["column"] = int(out["column"])
+    return out
+
+
+# reads build tool output line by line, collapses Ninja progress lines,
+# passes every other line through the filters (callables taking a line
+# without the trailing newline and returning the line to print or None to
+# drop it) and remembers the first compiler diagnostics. With a log
+# (cmake_cli.build_log.BuildLog) every line and diagnostic is also recorded
+# there, unfiltered.
+class OutputProcessor():
+    def __init__(self,
+                 filters=None,
+                 collapse_progress=True,
+                 max_diagnostics=5,
+                 log=None):
+        self.filters = [] if filters is None else filters
+        self.collapse_progress = collapse_progress
+        self.max_diagnostics = max_diagnostics
+        self.log = log
+        self.diagnostics = []
+        self.errors = 0
+        self.warnings = 0
+
+    def record_diagnostic(self, line):
+        diagnostic = parse_diagnostic(line)
+        if diagnostic is None:
+            return None
+        if self.log is not None:
+            self.log.add_diagnostic(diagnostic)
+        if diagnostic["severity"] == "warning":
+            self.warnings += 1
+        else:
+            self.errors += 1
+        if len(self.diagnostics) < self.max_diagnostics:
+            self.diagnostics.append(diagnostic)
+        return diagnostic
+
+    # on a terminal progress lines overwrite each other, otherwise only the
+    # progress line right before other output and the final one are kept
+    def run(self, stream, out, is_tty):
+        held_progress = None
+        overwriting = False
+        try:
+            for raw in iter(stream.readline, b""):
+                line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+                is_progress = progress_re.match(line) is not None
+                if self.log is not None:
+                    self.log.write(line)
+                    if is_progress:
+                        self.log.add_context(line, True)
+
+                if self.collapse_progress and is_progress:
+                    if is_tty:
+                        out.write("\r" + line + "\x1b[K")
+                        out.flush()
+                        overwriting = True
+                    else:
+                        held_progress = line
+                    continue
+
+                diagnostic = self.record_diagnostic(line)
+                if (self.log is not None and diagnostic is None
+                        and not is_progress):
+                    self.log.add_context(
+                        line, line.startswith(("FAILED: ", "ninja: ")))
+                for f in self.filters:
+                    line = f(line)
+                    if line is None:
+                        break
+                if line is None:
+                    continue
+
+                if overwriting:
+                    out.write("\n")
+                    overwriting = False
+                if held_progress is not None:
+                    out.write(held_progress + "\n")
+                    held_progress = None
+                out.write(line + "\n")
+                out.flush()
+
+            if overwriting:
+                out.write("\n")
+            if held_progress is not None:
+                out.write(held_progress + "\n")
+            out.flush()
+        except BrokenPipeError:
+            # the reader (usually a pager) went away, stop like a pipe would
+            pass
+
+    def summary(self):
+        if not self.diagnostics:
+            return ""
+        lines = [
+            "", "{} errors, {} warnings, first {}:".format(
+                self.errors, self.warnings, len(self.diagnostics))
+        ]
+        for d in self.diagnostics:
+            location = "{}:{}".format(d["file"], d["line"])
+            if d["column"] is not None:
+                location += ":{}".format(d["column"])
+            lines.append("  {}: {}: {}".format(location, d["severity"],
+                                               d["message"]))
+        return "\n".join(lines) + "\n"
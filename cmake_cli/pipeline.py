@@ -0,0 +1,109 @@
+import threading
+import time
+
+# separates the subcommands of a pipeline on the command line:
+#   cmake_cli staged_format_check + build --release + compile_commands
+separator = "+"
+
+
+def split_steps(argv):
+    steps = [[]]
+    for arg in argv:
+        if arg == separator:
+            steps.append([])
+        else:
+            steps[-1].append(arg)
+    return steps
+
+
+# resources are (reads, writes) sets, None conflicts with everything
+def conflict(first, second):
+    if first is None or second is None:
+        return True
+    first_reads, first_writes = first
+    second_reads, second_writes = second
+    return bool(first_writes & (second_reads | second_writes)
+                or second_writes & first_reads)
+
+
+# each step waits for the earlier steps it conflicts with
+def dependencies(resources):
+    return [[
+        j for j in range(i) if conflict(resources[j], resources[i])
+    ] for i in range(len(resources))]
+
+
+def exit_code(e):
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    # sys.exit("message") prints the message and exits with 1
+    print(e.code)
+    return 1
+
+
+# runs each step (a function) in its own thread once the steps it depends
+# on finished, steps after a failed one are skipped. Returns a dict per
+# step with its returncode (None if skipped), start and duration.
+def run_steps(steps, deps):
+    start = time.monotonic()
+    results = [{
+        "returncode": None,
+        "start": None,
+        "duration": None
+    } for _ in steps]
+    threads = []
+
+    def run(i):
+        for j in deps[i]:
+            threads[j].join()
+        if any(results[j]["returncode"] != 0 for j in deps[i]):
+            return
+        results[i]["start"] = time.monotonic() - start
+        try:
+            steps[i]()
+            results[i]["returncode"] = 0
+        except SystemExit as e:
+            results[i]["returncode"] = exit_code(e)
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            results[i]["returncode"] = 1
+        results[i]["duration"] = (time.monotonic() - start -
+                                  results[i]["start"])
+
+    for i in range(len(steps)):
+        threads.append(threading.Thread(target=run, args=(i, ),
+                                        daemon=True))
+        threads[-1].start()
+    for thread in threads:
+        # join with a timeout so KeyboardInterrupt reaches the main thread
+        while thread.is_alive():
+            thread.join(0.1)
+    return results
+
+
+def format_summary(names, results, wall):
+    def format_time(t):
+        return "-" if t is None else "{:.1f}s".format(t)
+
+    def status(returncode):
+        if returncode is None:
+            return "skipped"
+        return "ok" if returncode == 0 else "FAILED"
+
+    name_width = max(len(name) for name in names)
+    lines = [
+        "{}  {:>7}  {:>7}  {:>8}".format("step".ljust(name_width), "status",
+                                         "start", "duration")
+    ]
+    for name, r in zip(names, results):
+        lines.append("{}  {:>7}  {:>7}  {:>8}".format(
+            name.ljust(name_width), status(r["returncode"]),
+            format_time(r["start"]), format_time(r["duration"])))
+    total = sum(r["duration"] for r in results if r["duration"] is not None)
+    lines.append("{:.1f}s wall, {:.1f}s if run one after another".format(
+        wall, total))
+    return "\n".join(lines)
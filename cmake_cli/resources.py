@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import subprocess
+import time
+from contextlib import suppress
+
+from cmake_cli.cache import atomic_write_json, load_json
+
+cgroup_root = "/sys/fs/cgroup"
+
+# cgroup v1 reports "no limit" as a huge number instead of "max"
+unlimited_threshold = 1 << 60
+
+
+def read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# directories of the cgroups this process is in, v2 first then v1
+# controllers
+def cgroup_dirs(controller):
+    out = []
+    contents = read_text("/proc/self/cgroup")
+    if contents is None:
+        return out
+    for line in contents.splitlines():
+        _, controllers, path = line.split(":", 2)
+        if controllers == "":
+            out.append(os.path.join(cgroup_root, path.lstrip("/")))
+        elif controller in controllers.split(","):
+            for name in [controllers, controller]:
+                out.append(
+                    os.path.join(cgroup_root, name, path.lstrip("/")))
+    # inside a container the cgroup is usually mounted as the root
+    out.append(cgroup_root)
+    out.append(os.path.join(cgroup_root, controller))
+    return out
+
+
+def cgroup_cpu_quota():
+    for directory in cgroup_dirs("cpu"):
+        cpu_max = read_text(os.path.join(directory, "cpu.max"))
+        if cpu_max is not None:
+            quota, period = cpu_max.split()
+            if quota == "max":
+                return None
+            return int(quota) / int(period)
+
+        quota = read_text(os.path.join(directory, "cpu.cfs_quota_us"))
+        period = read_text(os.path.join(directory, "cpu.cfs_period_us"))
+        if quota is not None and period is not None:
+            if int(quota) <= 0:
+                return None
+            return int(quota) / int(period)
+    return None
+
+
+def affinity_cpu_count():
+    with suppress(AttributeError):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_limit():
+    cpus = affinity_cpu_count()
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def cgroup_memory():
+    for directory in cgroup_dirs("memory"):
+        limit = read_text(os.path.join(directory, "memory.max"))
+        usage = read_text(os.path.join(directory, "memory.current"))
+        if limit is None:
+            limit = read_text(
+                os.path.join(directory, "memory.limit_in_bytes"))
+            usage = read_text(
+                os.path.join(directory, "memory.usage_in_bytes"))
+        if limit is None:
+            continue
+        if limit == "max" or int(limit) >= unlimited_threshold:
+            return None, None
+        return int(limit), None if usage is None else int(usage)
+    return None, None
+
+
+def meminfo():
+    out = {}
+    contents = read_text("/proc/meminfo")
+    if contents is None:
+        return out
+    for line in contents.splitlines():
+        name, _, value = line.partition(":")
+        fields = value.split()
+        if fields:
+            out[name] = int(fields[0]) * 1024
+    return out
+
+
+# (total, available) bytes for this process, None if unknown
+def memory_limits():
+    info = meminfo()
+    total = info.get("MemTotal")
+    available = info.get("MemAvailable")
+
+    limit, usage = cgroup_memory()
+    if limit is not None:
+        total = limit if total is None else min(total, limit)
+        if usage is not None:
+            free = max(0, limit - usage)
+            available = free if available is None else min(available, free)
+
+    return total, available
+
+
+def rusage_log_path(directory):
+    return os.path.abspath(os.path.join(directory, "cmake_cli_rusage.log"))
+
+
+def memory_model_path(directory):
+    return os.path.join(directory, "cmake_cli_memory.json")
+
+
+# folds the records appended by cmake_cli.rusage_launcher into the per
+# output model kept in the build directory
+def update_memory_model(directory):
+    model = load_json(memory_model_path(directory), {})
+    log = rusage_log_path(directory)
+    try:
+        with open(log) as f:
+            lines = f.readlines()
+    except OSError:
+        return model
+
+    for line in lines:
+        with suppress(ValueError, KeyError):
+            record = json.loads(line)
+            model[record["output"]] = {
+                "kind": record["kind"],
+                "peak": record["peak"],
+            }
+    atomic_write_json(memory_model_path(directory), model)
+    os.remove(log)
+    return model
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# peak bytes to budget per job of each kind. Compiles use the 90th
+# percentile so one huge TU doesn't serialize the whole build, links are
+# few and heavy so they use the maximum.
+def job_memory(model):
+    out = {}
+    for kind, fraction in [("compile", 0.9), ("link", 1.0)]:
+        peaks = [v["peak"] for v in model.values() if v["kind"] == kind]
+        if peaks:
+            out[kind] = percentile(peaks, fraction)
+    return out
+
+
+def auto_jobs(directory):
+    jobs = cpu_limit()
+    compile_memory = job_memory(update_memory_model(directory)).get("compile")
+    _, available = memory_limits()
+    if compile_memory and available is not None:
+        jobs = min(jobs, max(1, available // compile_memory))
+    return jobs
+
+
+# link jobs which fit in total memory, rounded so small changes in the
+# learned peak don't change the generated build system
+def auto_link_jobs(directory):
+    link_memory = job_memory(load_json(memory_model_path(directory),
+                                       {})).get("link")
+    total, _ = memory_limits()
+    if not link_memory or total is None:
+        return None
+    step = 256 * 1024 * 1024
+    link_memory = -(-link_memory // step) * step
+    return max(1, total // link_memory)
+
+
+# runs cmd and returns (returncode, wall seconds, peak bytes) where peak is
+# the largest resident set of the command and the processes it waited for
+def run_measured(cmd, output=None, env=None):
+    start = time.time()
+    process = subprocess.Popen(cmd,
+                               stdout=output,
+                               stderr=subprocess.STDOUT
+                               if output is not None else None,
+                               env=env)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    process.returncode = returncode
+    # kilobytes on Linux
+    return returncode, elapsed, usage.ru_maxrss * 1024
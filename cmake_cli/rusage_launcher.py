@@ -0,0 +1,47 @@
+# compiler and linker launcher recording the peak memory of each job:
+#   python -m cmake_cli.rusage_launcher <log> <kind> <command>...
+import json
+import os
+import resource
+import subprocess
+import sys
+
+
+def output_of(cmd):
+    for i, arg in enumerate(cmd):
+        if arg == "-o" and i + 1 < len(cmd):
+            return cmd[i + 1]
+        if arg.startswith("-o") and len(arg) > 2:
+            return arg[2:]
+        if arg.startswith("/Fo") or arg.startswith("-Fo"):
+            return arg[3:]
+    return " ".join(cmd)
+
+
+def main():
+    log, kind, cmd = sys.argv[1], sys.argv[2], sys.argv[3:]
+    try:
+        returncode = subprocess.call(cmd)
+    except KeyboardInterrupt:
+        returncode = 1
+
+    if returncode == 0:
+        record = {
+            "output": output_of(cmd),
+            "kind": kind,
+            # kilobytes on Linux
+            "peak": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss *
+            1024,
+        }
+        # a single short O_APPEND write doesn't interleave with other jobs
+        fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record) + "\n").encode())
+        finally:
+            os.close(fd)
+
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
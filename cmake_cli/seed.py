@@ -0,0 +1,113 @@
+import os
+import re
+import shutil
+
+from cmake_cli.cache import hash_json
+
+version_dir_re = re.compile(r"^\d+\.\d+\.\d+")
+
+compiler_entry_re = re.compile(r"^CMAKE_[A-Za-z]+_COMPILER$")
+bootstrap_entries = {
+    "CMAKE_CACHE_MAJOR_VERSION", "CMAKE_CACHE_MINOR_VERSION",
+    "CMAKE_CACHE_PATCH_VERSION", "CMAKE_HOME_DIRECTORY", "CMAKE_GENERATOR",
+    "CMAKE_GENERATOR_PLATFORM", "CMAKE_GENERATOR_TOOLSET",
+    "CMAKE_GENERATOR_INSTANCE", "CMAKE_EXTRA_GENERATOR", "CMAKE_MAKE_PROGRAM",
+    "CMAKE_PLATFORM_INFO_INITIALIZED", "CMAKE_EXECUTABLE_FORMAT", "CMAKE_UNAME"
+}
+
+
+# what has to match for a build directory to reuse another's compiler
+# detection and probes: everything in the fingerprint except the
+# directory itself and the build type
+def compatibility_key(fingerprint):
+    gen_cmd = []
+    skip = False
+    for arg in fingerprint["gen_cmd"]:
+        if skip:
+            skip = False
+        elif arg == "-B":
+            skip = True
+        elif not arg.startswith(("-B", "-DCMAKE_BUILD_TYPE=")):
+            gen_cmd.append(arg)
+    return hash_json([gen_cmd, fingerprint["cwd"], fingerprint["env"]])
+
+
+# CMakeFiles/<cmake version>, which holds the detected compilers and
+# platform
+def platform_dirs(directory):
+    files_dir = os.path.join(directory, "CMakeFiles")
+    try:
+        names = os.listdir(files_dir)
+    except OSError:
+        return []
+    return [
+        os.path.join(files_dir, name) for name in names
+        if version_dir_re.match(name)
+        and os.path.isdir(os.path.join(files_dir, name))
+    ]
+
+
+def read_cache_entries(directory):
+    out = []
+    try:
+        with open(os.path.join(directory, "CMakeCache.txt")) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return out
+    for line in lines:
+        if line.startswith(("#", "//")) or "=" not in line:
+            continue
+        name_type, _, value = line.partition("=")
+        name, _, kind = name_type.partition(":")
+        out.append((name, kind, value))
+    return out
+
+
+# INTERNAL entries written by check_* and try_compile style probes. CMake's
+# own (CMAKE_*) and anything mentioning the sibling's paths, like
+# <project>_BINARY_DIR, stay behind.
+def probe_results(directory):
+    absolute = os.path.abspath(directory)
+    return [(name, value)
+            for name, kind, value in read_cache_entries(directory)
+            if kind == "INTERNAL" and not name.startswith(("CMAKE_", "_"))
+            and absolute not in value and not name.endswith(
+                ("_BINARY_DIR", "_SOURCE_DIR", "_IS_TOP_LEVEL"))]
+
+
+# what CMake needs to find in the cache to load the copied compiler
+# detection instead of redoing it, which it does (deleting CMakeFiles/<cmake
+# version>) whenever it starts from an empty cache, and the tools found
+# along with the compilers (CMAKE_AR, CMAKE_LINKER, ...)
+def is_bootstrap_entry(name, kind):
+    if name.endswith("-ADVANCED"):
+        name = name[:-len("-ADVANCED")]
+        kind = "FILEPATH" if name.startswith("CMAKE_") else None
+    return (name in bootstrap_entries or compiler_entry_re.match(name)
+            or (kind == "FILEPATH" and name.startswith("CMAKE_")))
+
+
+# copies the compiler detection and writes a CMakeCache.txt holding only the
+# entries locating it and the probe results
+def seed(sibling, directory):
+    os.makedirs(os.path.join(directory, "CMakeFiles"), exist_ok=True)
+    for source in platform_dirs(sibling):
+        target = os.path.join(directory, "CMakeFiles",
+                              os.path.basename(source))
+        if not os.path.exists(target):
+            shutil.copytree(source, target, symlinks=True)
+
+    lines = ["# seeded by cmake_cli from {}".format(sibling)]
+    lines += [
+        "{}:{}={}".format(name, kind, value)
+        for name, kind, value in read_cache_entries(sibling)
+        if is_bootstrap_entry(name, kind)
+    ]
+    lines += [
+        "{}:INTERNAL={}".format(name, value)
+        for name, value in probe_results(sibling)
+    ]
+    lines.append("CMAKE_CACHEFILE_DIR:INTERNAL={}".format(
+        os.path.abspath(directory)))
+    with open(os.path.join(directory, "CMakeCache.txt"), "w") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,156 @@
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cmake_cli.cache import (atomic_write_json, hash_bytes, hash_file,
+                             hash_json, load_json)
+from cmake_cli.compile_db import entry_arguments
+
+# arguments which make clang-tidy change files, results aren't cached then
+fix_flags = ["--fix", "-fix", "--fix-errors", "-fix-errors"]
+
+# compile flags dropped when preprocessing: outputs and dependency files
+# (which would overwrite the build's) and flags conflicting with -E
+dropped_flags = ["-c", "-MD", "-MMD", "-MP"]
+dropped_flags_with_value = ["-o", "-MF", "-MT", "-MQ"]
+
+
+def clang_tidy_version(clang_tidy):
+    return subprocess.run([clang_tidy, "--version"],
+                          stdout=subprocess.PIPE,
+                          check=True,
+                          universal_newlines=True).stdout.strip()
+
+
+# hashes of every .clang-tidy from the file's directory up, as configs can
+# inherit from their parents
+def config_hash(directory, memo):
+    if directory in memo:
+        return memo[directory]
+
+    config = os.path.join(directory, ".clang-tidy")
+    out = [hash_file(config)] if os.path.isfile(config) else []
+    parent = os.path.dirname(directory)
+    if parent != directory:
+        out = out + config_hash(parent, memo)
+
+    memo[directory] = out
+    return out
+
+
+def preprocess_cmd(arguments):
+    out = []
+    skip = False
+    for arg in arguments:
+        if skip:
+            skip = False
+        elif arg in dropped_flags:
+            pass
+        elif arg in dropped_flags_with_value:
+            skip = True
+        elif any(
+                arg.startswith(f) and len(arg) > len(f)
+                for f in dropped_flags_with_value):
+            pass
+        else:
+            out.append(arg)
+    # -C keeps comments, NOLINT markers change the result
+    return out + ["-E", "-C"]
+
+
+# hash of the preprocessed source, which covers every header it includes,
+# None if preprocessing fails (clang-tidy will report why)
+def preprocessed_hash(entry):
+    process = subprocess.run(preprocess_cmd(entry_arguments(entry)),
+                             cwd=entry["directory"],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+    if process.returncode != 0:
+        return None
+    return hash_bytes(process.stdout)
+
+
+def tidy_files(entries,
+               build_dir,
+               clang_tidy_args,
+               cache_path=None,
+               jobs=None,
+               clang_tidy="clang-tidy"):
+    args = shlex.split(clang_tidy_args)
+    use_cache = cache_path is not None and not any(a in fix_flags
+                                                   for a in args)
+
+    if use_cache:
+        version = clang_tidy_version(clang_tidy)
+        cache = load_json(cache_path, {})
+        if cache.get("version") != version:
+            cache = {"version": version, "files": {}}
+        key_base = [version, args]
+        config_hashes = {}
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    def key(entry, path):
+        preprocessed = preprocessed_hash(entry)
+        if preprocessed is None:
+            return None
+        return hash_json(key_base + [
+            entry_arguments(entry),
+            config_hash(os.path.dirname(path), config_hashes), preprocessed
+        ])
+
+    # returns (path, key, output, returncode, cached)
+    def run(entry):
+        path = os.path.normpath(
+            os.path.join(entry["directory"], entry["file"]))
+        file_key = None
+        if use_cache:
+            file_key = key(entry, path)
+            cached = cache["files"].get(path)
+            if (file_key is not None and cached is not None
+                    and cached["key"] == file_key):
+                return path, file_key, cached["output"], cached[
+                    "returncode"], True
+
+        process = subprocess.run([clang_tidy, "-p", build_dir] + args +
+                                 [path],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        output = process.stdout
+        # stderr is mostly "N warnings generated." unless clang-tidy failed
+        if process.returncode != 0:
+            output += process.stderr
+        return path, file_key, output, process.returncode, False
+
+    returncode = 0
+    cached_count = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run, entry) for entry in entries]
+        for future in as_completed(futures):
+            path, file_key, output, file_returncode, cached = future.result()
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+            if file_returncode != 0:
+                returncode = 1
+            if cached:
+                cached_count += 1
+            # crashes (negative) aren't a result of the file
+            elif use_cache and file_key is not None and file_returncode >= 0:
+                cache["files"][path] = {
+                    "key": file_key,
+                    "output": output,
+                    "returncode": file_returncode,
+                }
+
+    if use_cache:
+        atomic_write_json(cache_path, cache)
+
+    print("ran clang-tidy on {} files ({} unchanged, from cache)".format(
+        len(entries), cached_count))
+
+    return returncode
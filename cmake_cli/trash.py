@@ -0,0 +1,74 @@
+# deletes directories moved aside by clean:
+#   python -m cmake_cli.trash <trash directory>
+import errno
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+
+# renames paths into a new directory inside trash_dir so they are gone from
+# their place at once, paths on another file system are deleted right away
+def move_to_trash(paths, trash_dir):
+    os.makedirs(trash_dir, exist_ok=True)
+    batch = tempfile.mkdtemp(dir=trash_dir)
+    for i, path in enumerate(paths):
+        # names repeat, for example CMakeFiles/foo.dir in two directories
+        name = "{}_{}".format(i, os.path.basename(path))
+        try:
+            os.rename(path, os.path.join(batch, name))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            delete_tree(path)
+    return batch
+
+
+# unlinks files from several threads, which helps on large trees and
+# network file systems, then removes the now empty directories
+def delete_tree(path, jobs=16):
+    files = []
+    directories = []
+    for root, dirs, names in os.walk(path):
+        directories.append(root)
+        files += [os.path.join(root, n) for n in names]
+        # symlinks to directories are listed in dirs but not walked
+        files += [
+            os.path.join(root, d) for d in dirs
+            if os.path.islink(os.path.join(root, d))
+        ]
+
+    def unlink(path):
+        with suppress(OSError):
+            os.unlink(path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(unlink, files, chunksize=256))
+    for directory in reversed(directories):
+        with suppress(OSError):
+            os.rmdir(directory)
+
+
+# deletes everything in trash_dir, including batches left behind by
+# earlier runs which were interrupted
+def empty_trash(trash_dir, jobs=16):
+    with suppress(OSError):
+        for name in os.listdir(trash_dir):
+            delete_tree(os.path.join(trash_dir, name), jobs=jobs)
+    with suppress(OSError):
+        os.rmdir(trash_dir)
+
+
+# runs empty_trash in a process which outlives this one
+def empty_trash_in_background(trash_dir):
+    subprocess.Popen([sys.executable, "-m", "cmake_cli.trash", trash_dir],
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+if __name__ == "__main__":
+    empty_trash(sys.argv[1])
@@ -0,0 +1,167 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import subprocess
+import threading
+import time
+
+in_attrib = 0x00000004
+in_close_write = 0x00000008
+in_moved_from = 0x00000040
+in_moved_to = 0x00000080
+in_create = 0x00000100
+in_delete = 0x00000200
+in_delete_self = 0x00000400
+in_q_overflow = 0x00004000
+in_isdir = 0x40000000
+
+watch_mask = (in_attrib | in_close_write | in_moved_from | in_moved_to
+              | in_create | in_delete | in_delete_self)
+
+event_header = struct.Struct("iIII")
+
+# returned instead of paths when changes were lost
+overflowed = "<overflow>"
+
+
+class InotifyWatcher():
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        self.add_watch_fn = libc.inotify_add_watch
+        self.add_watch_fn.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for directory in directories:
+            self.add_watch(directory)
+
+    def add_watch(self, directory):
+        wd = self.add_watch_fn(self.fd, os.fsencode(directory), watch_mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(),
+                          "inotify_add_watch failed for " + directory)
+        self.watches[wd] = directory
+
+    def add_tree(self, directory, should_watch):
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [
+                d for d in dirs if should_watch(os.path.join(root, d))
+            ]
+            self.add_watch(root)
+
+    # returns changed paths, empty if nothing changed within timeout
+    def wait(self, timeout, should_watch):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & in_q_overflow:
+                changed.add(overflowed)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & in_isdir:
+                if mask & (in_create | in_moved_to) and should_watch(path):
+                    self.add_tree(path, should_watch)
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+# fallback when inotify isn't available: compares mtimes of the files
+# returned by list_files every interval
+class PollingWatcher():
+    def __init__(self, list_files, interval):
+        self.list_files = list_files
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        out = {}
+        for path in self.list_files():
+            try:
+                out[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return out
+
+    def wait(self, timeout, _):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.take_snapshot()
+        changed = set(path for path in set(snapshot) | set(self.snapshot)
+                      if snapshot.get(path) != self.snapshot.get(path))
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+# runs commands one after another in the background, can be cancelled
+class BuildJob():
+    def __init__(self, cmds, env=None):
+        self.cmds = cmds
+        self.env = env
+        self.process = None
+        self.cancelled = False
+        self.returncode = None
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        returncode = 0
+        for cmd in self.cmds:
+            with self.lock:
+                if self.cancelled:
+                    break
+                print("running:", cmd, flush=True)
+                # own process group so cancelling reaches the compilers too
+                self.process = subprocess.Popen(cmd,
+                                                env=self.env,
+                                                start_new_session=True)
+            returncode = self.process.wait()
+            if returncode != 0:
+                break
+        self.returncode = returncode
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            # ninja and make clean up partial outputs on SIGINT
+            os.killpg(process.pid, signal.SIGINT)
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+        self.thread.join()